@@ -12,31 +12,112 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import argparse
+import calendar
 import json
+import os
 import time
+from typing import Tuple
 
 import config
+import schemas
 
 import apache_beam as beam
-from apache_beam.options.pipeline_options import PipelineOptions
-from apache_beam.transforms import trigger
+from apache_beam import coders
+from apache_beam.metrics import Metrics
+from apache_beam.options.pipeline_options import GoogleCloudOptions, PipelineOptions, StandardOptions, WorkerOptions
+from apache_beam.transforms import trigger, window
 from apache_beam.io.gcp.pubsub import ReadFromPubSub
 from apache_beam.io.gcp.bigquery import BigQueryDisposition, WriteToBigQuery
-from apache_beam.runners import DataflowRunner
+from apache_beam.io.filesystems import FileSystems
+from apache_beam.io.textio import ReadFromText, WriteToText
+from apache_beam.utils.timestamp import Timestamp
 
-# Defining event filter functions.
+ITEM_VIEWS_COLUMNS = schemas.columns(schemas.ITEM_VIEWS)
 
+# Copy of datalayer/ecommerce_events_bq_schema.json, next to this file so the template container has it.
+EVENTS_SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ecommerce_events_bq_schema.json")
 
-def is_item_view(event):
-    return event['event'] == 'view_item'
+# Event types routed to their own PCollection, everything else goes to the dead letter output.
+EVENT_TYPES = ('view_item', 'add_to_cart', 'purchase')
+DEAD_LETTER = 'dead_letter'
 
 
-def is_add_to_cart(event):
-    return event['event'] == 'add_to_cart'
+class ParseAndRouteFn(beam.DoFn):
+    """Parses a message into an event and emits it to the output tagged with its `event` type.
+  Malformed JSON and unknown event types are emitted to `DEAD_LETTER` with the raw
+  payload and the reason, so every message is looked at exactly once.
+  """
+
+    def process(self, element):
+        try:
+            event = json.loads(element)
+            event_type = event['event']
+        except (ValueError, TypeError, KeyError) as e:
+            yield beam.pvalue.TaggedOutput(DEAD_LETTER, self.dead_letter(element, f"Malformed event: {e!r}"))
+            return
+
+        if event_type in EVENT_TYPES:
+            yield beam.pvalue.TaggedOutput(event_type, event)
+        else:
+            yield beam.pvalue.TaggedOutput(DEAD_LETTER, self.dead_letter(element, f"Unknown event type: {event_type!r}"))
+
+    @staticmethod
+    def dead_letter(element, error):
+        if isinstance(element, bytes):
+            element = element.decode('utf-8', errors='replace')
+        return {'payload': element, 'error': error}
+
+
+def item_view_plan(columns=ITEM_VIEWS_COLUMNS, schema_file=EVENTS_SCHEMA_FILE):
+    """Splits the item view columns into fields of the event and fields of each of its
+  `ecommerce.items`, following the layout of the events schema.
+  """
+    with open(schema_file) as f:
+        schema = json.load(f)
+
+    event_fields = {field['name'] for field in schema if field['type'] != 'RECORD'}
+    ecommerce = next(field for field in schema if field['name'] == 'ecommerce')
+    items = next(field for field in ecommerce['fields'] if field['name'] == 'items')
+    item_fields = {field['name'] for field in items['fields']}
+
+    unknown = [column for column in columns if column not in event_fields and column not in item_fields]
+    if unknown:
+        raise ValueError(f"Columns {unknown} are not in {schema_file}")
+    return ([column for column in columns if column in event_fields],
+            [column for column in columns if column in item_fields])
+
+
+class FlattenItemViews(beam.DoFn):
+    """Emits one item view row per item of a view_item event.
+  The plan of which fields come from the event and which from the item is computed
+  once when the pipeline is built and shipped to the workers with the DoFn. Missing
+  fields are left empty.
+  """
+
+    def __init__(self, plan=None):
+        self.event_columns, self.item_columns = plan or item_view_plan()
+
+    def process(self, element):
+        event_values = [(column, element.get(column)) for column in self.event_columns]
+        for item in (element.get('ecommerce') or {}).get('items') or ():
+            row = dict(event_values)
+            for column in self.item_columns:
+                row[column] = item.get(column)
+            yield row
 
 
-def is_purchase(event):
-    return event['event'] == 'purchase'
+def parse_datetime(value):
+    """Unix timestamp of a DATETIME string, the data layer writes them in UTC."""
+    return calendar.timegm(time.strptime(value, "%Y-%m-%d %H:%M:%S"))
+
+
+def event_timestamp(event):
+    return parse_datetime(event['event_datetime'])
+
+
+def format_datetime(timestamp):
+    return timestamp.to_utc_datetime().strftime("%Y-%m-%d %H:%M:%S")
 
 
 class ExtractValueFn(beam.DoFn):
@@ -45,122 +126,411 @@ class ExtractValueFn(beam.DoFn):
         return [element['ecommerce']['purchase']['value']]
 
 
+# (count, sum, min, max, mean) of the purchase values of a user.
+PurchaseStats = Tuple[int, float, float, float, float]
+
+
+class PurchaseStatsFn(beam.CombineFn):
+    """Counts purchase values and keeps their sum, min and max in a single accumulator.
+  The accumulator is a flat tuple with its own coder, so the partial results the runner
+  combines before the shuffle are encoded compactly instead of pickled.
+  """
+
+    def create_accumulator(self):
+        return (0, 0.0, float('inf'), float('-inf'))
+
+    def add_input(self, accumulator, value):
+        count, total, low, high = accumulator
+        return (count + 1, total + value, min(low, value), max(high, value))
+
+    def merge_accumulators(self, accumulators):
+        counts, totals, lows, highs = zip(*accumulators)
+        return (sum(counts), sum(totals), min(lows), max(highs))
+
+    def extract_output(self, accumulator):
+        count, total, low, high = accumulator
+        return (count, total, low, high, total / count if count else 0.0)
+
+    def get_accumulator_coder(self):
+        return coders.TupleCoder([coders.VarIntCoder(), coders.FloatCoder(), coders.FloatCoder(), coders.FloatCoder()])
+
+
 class ExtractAndSumValue(beam.PTransform):
-    """A transform to extract key/score information and sum the scores.
-  The constructor argument `field` determines whether 'team' or 'user' info is
-  extracted.
+    """A transform to extract the purchase value per user and combine count, sum,
+  min, max and mean of the values in one pass.
   """
 
     def expand(self, pcoll):
         sum_val = (
             pcoll
-            | beam.Map(lambda elem: (elem['user_id'], elem['ecommerce']['purchase']['value']))
-            | beam.CombinePerKey(sum))
+            | beam.Map(lambda elem: (elem['user_id'], float(elem['ecommerce']['purchase']['value']))
+                       ).with_output_types(Tuple[str, float])
+            | beam.CombinePerKey(PurchaseStatsFn()).with_output_types(Tuple[str, PurchaseStats]))
         return(sum_val)
 
 
+def stats_row(elem):
+    user_id, (count, total, low, high, mean) = elem
+    return {'user_id': user_id,
+            'summed_value': total,
+            'purchase_count': count,
+            'min_value': low,
+            'max_value': high,
+            'mean_value': mean
+            }
+
+
 class FormatByRow(beam.PTransform):
     """A transform to reformat the data to column name/value format.
+  With `windowed` the start and end of the element's window are added as columns.
   """
 
+    def __init__(self, windowed=False):
+        super().__init__()
+        self.windowed = windowed
+
     def expand(self, pcoll):
+        if self.windowed:
+            return pcoll | beam.Map(lambda elem, win=beam.DoFn.WindowParam: dict(stats_row(elem),
+                                                                                    window_start=format_datetime(win.start),
+                                                                                    window_end=format_datetime(win.end)))
         row_val = (
             pcoll
-            | beam.Map(lambda elem: {'user_id': elem[0],
-                                     'summed_value': elem[1]
-                                     })
+            | beam.Map(stats_row)
         )
         return(row_val)
 
 
-def streaming_pipeline(project, region):
+class AggregatePurchases(beam.PTransform):
+    """Sums the purchase values per user and formats them as BigQuery rows.
 
-    subscription = "projects/{}/subscriptions/hyp_subscription_dataflow".format(
-        project)
-
-    bucket = "gs://{}-ecommerce-events/tmp_dir".format(project)
+  `mode` 'global' keeps one running sum per user in the global window, re-emitted
+  every 10 purchases. 'fixed' and 'sliding' window the purchases by their
+  `event_datetime` and emit one row per user and window once the watermark passes
+  the end of the window. Purchases arriving up to `allowed_lateness` seconds late
+  are emitted as additional rows holding only the late values, so summing the rows
+  of a window gives its total. Older purchases are dropped and the window state freed.
+  From Pub/Sub the watermark follows the publish time, so the windowed modes only
+  see purchases whose `event_datetime` is the time they were sent.
+  """
 
-    # Defining pipeline options.
-    options = PipelineOptions(
-        streaming=True,
-        project=project,
-        region=region,
-        staging_location="%s/staging" % bucket,
-        temp_location="%s/temp" % bucket,
-        subnetwork='regions/europe-west1/subnetworks/terraform-network',
-        service_account_email='retailpipeline-hyp@{}.iam.gserviceaccount.com'.format(
-            project),
-        max_num_workers=1
-    )
+    def __init__(self, mode='global', window_size=60, window_period=15, allowed_lateness=120):
+        super().__init__()
+        if mode not in ('global', 'fixed', 'sliding'):
+            raise ValueError(f"Unknown aggregation mode {mode!r}, expected 'global', 'fixed' or 'sliding'")
+        self.mode = mode
+        self.window_size = window_size
+        self.window_period = window_period
+        self.allowed_lateness = allowed_lateness
 
-    # Defining pipeline.
-    p = beam.Pipeline(DataflowRunner(), options=options)
-
-    # Receiving message from Pub/Sub & parsing json from string.
-    json_message = (p
-                    # Listining to Pub/Sub.
-                    | "Read Topic" >> ReadFromPubSub(subscription=subscription)
-                    # Parsing json from message string.
-                    | "Parse json" >> beam.Map(json.loads)
+    def expand(self, pcoll):
+        if self.mode == 'global':
+            return (pcoll
+                    | 'Global Window' >> beam.WindowInto(window.GlobalWindows(),
+                                                         trigger=trigger.Repeatedly(
+                                                             trigger.AfterCount(10)),
+                                                         accumulation_mode=trigger.AccumulationMode.ACCUMULATING)
+                    | 'ExtractAndSumValue' >> ExtractAndSumValue()
+                    | 'FormatByRow' >> FormatByRow()
                     )
 
-    # Extracting Item Views.
-    item_views = (json_message
-                  | 'Filter for item views' >> beam.Filter(is_item_view)
-                  | "item view row" >> beam.Map(lambda input: {'event_datetime': input['event_datetime'],  # Dropping and renaming columns.
-                                                               'event': input['event'],
-                                                               'user_id':  input['user_id'],
-                                                               'client_id': input['client_id'],
-                                                               'page': input['page'],
-                                                               'page_previous': input['page_previous'],
-                                                               "item_name": input['ecommerce']['items'][0]["item_name"],
-                                                               "item_id": input['ecommerce']['items'][0]["item_id"],
-                                                               "price": input['ecommerce']['items'][0]["price"],
-                                                               "item_brand": input['ecommerce']['items'][0]["item_brand"],
-                                                               "item_category": input['ecommerce']['items'][0]["item_category"],
-                                                               "item_category_2": input['ecommerce']['items'][0]["item_category_2"],
-                                                               "item_category_3": input['ecommerce']['items'][0]["item_category_3"],
-                                                               "item_category_4": input['ecommerce']['items'][0]["item_category_4"],
-                                                               "item_variant": input['ecommerce']['items'][0]["item_variant"],
-                                                               "item_list_name": input['ecommerce']['items'][0]["item_list_name"],
-                                                               "item_list_id": input['ecommerce']['items'][0]["item_list_id"],
-                                                               "quantity": input['ecommerce']['items'][0]["quantity"]
-                                                               })
-                  )
-
-    fixed_windowed_items = (json_message
-                            | 'Filter for purchase' >> beam.Filter(is_purchase)
-                            | 'Global Window' >> beam.WindowInto(beam.window.GlobalWindows(),
-                                                                 trigger=trigger.Repeatedly(
-                                                                     trigger.AfterCount(10)),
-                                                                 accumulation_mode=trigger.AccumulationMode.ACCUMULATING)
-                            | 'ExtractAndSumValue' >> ExtractAndSumValue()
-                            | 'FormatByRow' >> FormatByRow()
+        if self.mode == 'fixed':
+            windows = window.FixedWindows(self.window_size)
+        else:
+            windows = window.SlidingWindows(self.window_size, self.window_period)
+
+        return (pcoll
+                | 'Event Time' >> beam.Map(lambda event: window.TimestampedValue(event, event_timestamp(event)))
+                | 'Event Time Window' >> beam.WindowInto(windows,
+                                                         trigger=trigger.AfterWatermark(
+                                                             late=trigger.AfterCount(1)),
+                                                         allowed_lateness=self.allowed_lateness,
+                                                         accumulation_mode=trigger.AccumulationMode.DISCARDING)
+                | 'ExtractAndSumValue' >> ExtractAndSumValue()
+                | 'FormatByRow' >> FormatByRow(windowed=True)
+                )
+
+
+def build_pipeline(messages, aggregation_mode=config.aggregation_mode, window_size=config.window_size,
+                   window_period=config.window_period, allowed_lateness=config.allowed_lateness):
+    """Applies the processing to a PCollection of raw event messages, independent of source and sink.
+  Returns a dict of output table name to its PCollection of rows.
+  """
+
+    # Parsing json from message string & routing by event type.
+    events = messages | "Parse and route" >> beam.ParDo(ParseAndRouteFn()).with_outputs(*EVENT_TYPES, DEAD_LETTER)
+
+    # Extracting Item Views, one row per viewed item.
+    item_views = events.view_item | "item view rows" >> beam.ParDo(FlattenItemViews())
+
+    fixed_windowed_items = (events.purchase
+                            | 'Aggregate purchases' >> AggregatePurchases(mode=aggregation_mode,
+                                                                          window_size=window_size,
+                                                                          window_period=window_period,
+                                                                          allowed_lateness=allowed_lateness)
                             )
 
-    # Writing summed values to BigQuery
-    aggregated_schema = "user_id:STRING, summed_value:FLOAT"
-    aggregated_table = "{}:ecommerce_sink.beam_aggregated".format(project)
+    # Windowed sums go to their own table as they carry the window bounds.
+    aggregated_table = "beam_aggregated" if aggregation_mode == 'global' else "beam_aggregated_windowed"
 
-    fixed_windowed_items | "Write Summed Values To BigQuery" >> WriteToBigQuery(table=aggregated_table, schema=aggregated_schema,
-                                                                                create_disposition=BigQueryDisposition.CREATE_IF_NEEDED,
-                                                                                write_disposition=BigQueryDisposition.WRITE_APPEND)
+    return {
+        "beam_item_views": item_views,
+        aggregated_table: fixed_windowed_items,
+        # Keeping messages that could not be routed for inspection.
+        "beam_dead_letter": events[DEAD_LETTER],
+    }
 
-    # Writing the PCollections to two differnt BigQuery tables.
-    item_views_table = "{}:ecommerce_sink.beam_item_views".format(project)
-    schema = "event_datetime:DATETIME, event:STRING, user_id:STRING, client_id:STRING, page:STRING, page_previous:STRING, " \
-        "item_name:STRING, item_id:STRING, price:STRING, item_brand:STRING, item_category:STRING, item_category_2:STRING, item_category_3:STRING, " \
-        "item_category_4:STRING, item_variant:STRING, item_list_name:STRING, item_list_id:STRING, quantity:STRING"
 
-    item_views | "Write Items Views To BigQuery" >> WriteToBigQuery(table=item_views_table, schema=schema,
-                                                                    create_disposition=BigQueryDisposition.CREATE_IF_NEEDED,
-                                                                    write_disposition=BigQueryDisposition.WRITE_APPEND)
+# Ways of writing rows to BigQuery, STORAGE_WRITE_API is exactly-once.
+WRITE_METHODS = ('STREAMING_INSERTS', 'STORAGE_WRITE_API', 'STORAGE_API_AT_LEAST_ONCE', 'FILE_LOADS')
+STORAGE_WRITE_METHODS = ('STORAGE_WRITE_API', 'STORAGE_API_AT_LEAST_ONCE')
 
-    return p.run()
 
+def datetime_to_timestamp(value):
+    return Timestamp(parse_datetime(value))
 
-if __name__ == '__main__':
-    GCP_PROJECT = config.project_id
-    GCP_REGION = config.location
 
-    streaming_pipeline(project=GCP_PROJECT, region=GCP_REGION)
+# Python types the Storage Write API expects per column type, it does not convert values like streaming inserts do.
+STORAGE_WRITE_TYPES = {
+    "STRING": str,
+    "FLOAT": float,
+    "INTEGER": int,
+    "DATETIME": datetime_to_timestamp,
+}
+
+
+def storage_write_converters(fields):
+    return [(name, STORAGE_WRITE_TYPES[field_type]) for name, field_type in fields]
+
+
+def coerce_row(row, converters):
+    """Converts the values of a row to the types of their columns, missing values become None."""
+    return {name: None if row.get(name) is None else convert(row[name]) for name, convert in converters}
+
+
+class BigQuerySink(beam.PTransform):
+    """Writes rows to a table of the ecommerce_sink dataset with the chosen write method.
+  `triggering_frequency` is the seconds between load jobs of FILE_LOADS and between
+  commits of the exactly-once STORAGE_WRITE_API in streaming pipelines.
+  """
+
+    def __init__(self, table, project, method='STREAMING_INSERTS', triggering_frequency=5, streaming=True):
+        super().__init__()
+        if method not in WRITE_METHODS:
+            raise ValueError(f"Unknown write method {method!r}, expected one of {WRITE_METHODS}")
+        self.table = table
+        self.project = project
+        self.method = method
+        self.triggering_frequency = triggering_frequency if streaming else None
+
+    def expand(self, pcoll):
+        fields = schemas.TABLES[self.table]
+        options = dict(table="{}:ecommerce_sink.{}".format(self.project, self.table),
+                       create_disposition=BigQueryDisposition.CREATE_IF_NEEDED,
+                       write_disposition=BigQueryDisposition.WRITE_APPEND)
+
+        if self.method in STORAGE_WRITE_METHODS:
+            at_least_once = self.method == 'STORAGE_API_AT_LEAST_ONCE'
+            return (pcoll
+                    | 'Coerce' >> beam.Map(coerce_row, storage_write_converters(fields))
+                    | 'Write' >> WriteToBigQuery(schema=schemas.table_schema(fields, storage_write_api=True),
+                                                 method=WriteToBigQuery.Method.STORAGE_WRITE_API,
+                                                 use_at_least_once=at_least_once,
+                                                 triggering_frequency=None if at_least_once else self.triggering_frequency,
+                                                 **options))
+
+        if self.method == 'FILE_LOADS':
+            return pcoll | 'Write' >> WriteToBigQuery(schema=schemas.table_schema(fields),
+                                                      method=WriteToBigQuery.Method.FILE_LOADS,
+                                                      triggering_frequency=self.triggering_frequency,
+                                                      **options)
+
+        return pcoll | 'Write' >> WriteToBigQuery(schema=schemas.table_schema(fields),
+                                                  method=WriteToBigQuery.Method.STREAMING_INSERTS,
+                                                  **options)
+
+
+class FakeBigQueryWriteFn(beam.DoFn):
+    """Encodes rows and groups them into requests of at most `max_rows` rows and
+  `max_bytes` bytes, None means unlimited. Sending a request waits `latency` seconds.
+  """
+
+    def __init__(self, table, binary, max_rows, max_bytes, latency):
+        self.table = table
+        self.binary = binary
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.latency = latency
+
+        self.requests = Metrics.counter(table, 'requests')
+        self.rows = Metrics.counter(table, 'rows')
+        self.bytes = Metrics.counter(table, 'bytes')
+
+    def setup(self):
+        self.coder = coders.FastPrimitivesCoder()
+
+    def start_bundle(self):
+        self.batch = []
+        self.batch_bytes = 0
+
+    def process(self, element):
+        if self.binary:
+            # Stands in for the protocol buffer rows of the Storage Write API.
+            encoded = self.coder.encode(tuple(value.micros if isinstance(value, Timestamp) else value
+                                              for value in element.values()))
+        else:
+            encoded = json.dumps(element).encode('utf-8')
+
+        if self.batch and ((self.max_rows and len(self.batch) >= self.max_rows) or
+                           (self.max_bytes and self.batch_bytes + len(encoded) > self.max_bytes)):
+            self.send()
+        self.batch.append(encoded)
+        self.batch_bytes += len(encoded)
+
+    def finish_bundle(self):
+        if self.batch:
+            self.send()
+
+    def send(self):
+        if self.latency:
+            time.sleep(self.latency)
+        self.requests.inc()
+        self.rows.inc(len(self.batch))
+        self.bytes.inc(self.batch_bytes)
+        self.batch = []
+        self.batch_bytes = 0
+
+
+class FakeBigQuerySink(beam.PTransform):
+    """Local stand-in for BigQuerySink to compare the write methods without GCP.
+  Rows are converted, shuffled, encoded and batched the way `method` does it:
+  STREAMING_INSERTS sends JSON in requests of 500 rows, the Storage Write API sends
+  typed binary rows in appends of up to 10 MB (exactly-once shuffles them first to
+  fix their stream offsets) and FILE_LOADS writes every bundle as one JSON load.
+  Requests, rows and bytes are reported as Beam metrics in the table's namespace.
+  """
+
+    LIMITS = {
+        'STREAMING_INSERTS': (500, 10 << 20),
+        'STORAGE_WRITE_API': (None, 10 << 20),
+        'STORAGE_API_AT_LEAST_ONCE': (None, 10 << 20),
+        'FILE_LOADS': (None, None),
+    }
+
+    def __init__(self, table, method='STREAMING_INSERTS', latency=0.0):
+        super().__init__()
+        if method not in WRITE_METHODS:
+            raise ValueError(f"Unknown write method {method!r}, expected one of {WRITE_METHODS}")
+        self.table = table
+        self.method = method
+        self.latency = latency
+
+    def expand(self, pcoll):
+        binary = self.method in STORAGE_WRITE_METHODS
+        if binary:
+            pcoll = pcoll | 'Coerce' >> beam.Map(coerce_row, storage_write_converters(schemas.TABLES[self.table]))
+        if self.method == 'STORAGE_WRITE_API':
+            pcoll = pcoll | 'Reshuffle' >> beam.Reshuffle()
+
+        max_rows, max_bytes = self.LIMITS[self.method]
+        return pcoll | 'Write' >> beam.ParDo(FakeBigQueryWriteFn(self.table, binary, max_rows, max_bytes, self.latency))
+
+
+def read_lines(pattern):
+    """Reads newline-delimited messages, e.g. a corpus from datalayer/synth_data_stream.py, into memory."""
+    lines = []
+    for metadata in sorted(FileSystems.match([pattern])[0].metadata_list, key=lambda m: m.path):
+        # Compression is detected from the file extension.
+        with FileSystems.open(metadata.path) as f:
+            lines.extend(line.decode('utf-8').rstrip('\n') for line in f if line.strip())
+    return lines
+
+
+def run(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--source', choices=['pubsub', 'file', 'memory'], default='pubsub',
+                        help="Read from the Pub/Sub subscription, stream newline-delimited events from files "
+                             "or load them into memory first so reading does not count towards processing")
+    parser.add_argument('--input', help="Subscription for 'pubsub' (hyp_subscription_dataflow by default), "
+                                        "file pattern for 'file' and 'memory'")
+    parser.add_argument('--sink', choices=['bigquery', 'file', 'fake'], default='bigquery',
+                        help="Write rows to the ecommerce_sink dataset, as newline-delimited JSON files "
+                             "or to a local fake of BigQuery that only counts requests, rows and bytes")
+    parser.add_argument('--output', help="Directory of the 'file' sink, one set of files per table")
+    parser.add_argument('--write_method', choices=WRITE_METHODS, default=config.write_method,
+                        help="How the 'bigquery' and 'fake' sinks write rows")
+    parser.add_argument('--triggering_frequency', type=int, default=config.triggering_frequency,
+                        help="Seconds between FILE_LOADS load jobs and STORAGE_WRITE_API commits when streaming")
+    parser.add_argument('--fake_sink_latency', type=float, default=0.0,
+                        help="Seconds each request to the 'fake' sink takes")
+    parser.add_argument('--aggregation_mode', choices=['global', 'fixed', 'sliding'], default=config.aggregation_mode,
+                        help="Running sum per user or event time windows of the purchase values")
+    known_args, pipeline_args = parser.parse_known_args(argv)
+
+    if known_args.source != 'pubsub' and not known_args.input:
+        parser.error(f"--input is required for --source {known_args.source}")
+    if known_args.sink == 'file' and not known_args.output:
+        parser.error("--output is required for --sink file")
+    if known_args.sink == 'file' and known_args.source == 'pubsub':
+        parser.error("--sink file needs a bounded --source, file or memory")
+
+    # Every other option (--runner, --num_workers, --max_num_workers, --direct_num_workers, ...) is a Beam pipeline option.
+    options = PipelineOptions(pipeline_args)
+    standard_options = options.view_as(StandardOptions)
+    gcp_options = options.view_as(GoogleCloudOptions)
+    worker_options = options.view_as(WorkerOptions)
+
+    standard_options.runner = standard_options.runner or 'DataflowRunner'
+    standard_options.streaming = known_args.source == 'pubsub'
+    gcp_options.project = gcp_options.project or config.project_id
+    gcp_options.region = gcp_options.region or config.location
+    project = gcp_options.project
+
+    if standard_options.runner == 'DataflowRunner':
+        # Defaults of the deployed job, all of them can be overridden on the command line.
+        bucket = "gs://{}-ecommerce-events/tmp_dir".format(project)
+        gcp_options.staging_location = gcp_options.staging_location or "%s/staging" % bucket
+        gcp_options.temp_location = gcp_options.temp_location or "%s/temp" % bucket
+        gcp_options.service_account_email = gcp_options.service_account_email or \
+            'retailpipeline-hyp@{}.iam.gserviceaccount.com'.format(project)
+        worker_options.subnetwork = worker_options.subnetwork or 'regions/europe-west1/subnetworks/terraform-network'
+        worker_options.max_num_workers = worker_options.max_num_workers or 1
+
+    # Defining pipeline.
+    p = beam.Pipeline(options=options)
+
+    if known_args.source == 'pubsub':
+        subscription = known_args.input or "projects/{}/subscriptions/hyp_subscription_dataflow".format(project)
+        # Listining to Pub/Sub.
+        messages = p | "Read Topic" >> ReadFromPubSub(subscription=subscription)
+    elif known_args.source == 'file':
+        messages = p | "Read Files" >> ReadFromText(known_args.input)
+    else:
+        messages = p | "Read Memory" >> beam.Create(read_lines(known_args.input))
+
+    outputs = build_pipeline(messages, aggregation_mode=known_args.aggregation_mode)
+
+    for table, rows in outputs.items():
+        if known_args.sink == 'bigquery':
+            rows | f"Write {table} To BigQuery" >> BigQuerySink(table, project, method=known_args.write_method,
+                                                                triggering_frequency=known_args.triggering_frequency,
+                                                                streaming=standard_options.streaming)
+        elif known_args.sink == 'fake':
+            rows | f"Write {table} To Fake BigQuery" >> FakeBigQuerySink(table, method=known_args.write_method,
+                                                                         latency=known_args.fake_sink_latency)
+        else:
+            (rows
+             | f"Serialize {table}" >> beam.Map(json.dumps)
+             | f"Write {table} To Files" >> WriteToText(os.path.join(known_args.output, table), file_name_suffix='.jsonl'))
+
+    result = p.run()
+    if not standard_options.streaming and standard_options.runner != 'DataflowRunner':
+        result.wait_until_finish()
+        if known_args.sink == 'fake':
+            for counter in result.metrics().query()['counters']:
+                print(f"{counter.key.metric.namespace} {counter.key.metric.name}: {counter.committed}")
+    return result
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,200 @@
+# Copyright 2023 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Throughput of the beam_processing.py transforms on a synthetic bounded corpus, per transform and for the whole graph.
+#
+# python3 benchmark.py --events 200000 --direct-num-workers 1 4 --output results.json
+
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+import apache_beam as beam
+from apache_beam.io.textio import ReadFromText
+from apache_beam.options.pipeline_options import PipelineOptions
+
+import beam_processing
+
+DATALAYER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "datalayer")
+
+
+def write_inputs(directory, events, users, seed):
+    """Writes the stage inputs as newline-delimited JSON, returns their paths and sizes by input name.
+
+    Events are shaped like datalayer/*.json and generated by synth_data_stream.py.
+    Inputs are read from files because beam.Create would pickle and compress all
+    elements into the pipeline definition, which costs more than the transforms.
+    """
+    sys.path.insert(0, DATALAYER_DIR)
+    import synth_data_stream
+
+    corpus = list(synth_data_stream.generate_corpus(events, synth_data_stream.load_fixtures(),
+                                                    synth_data_stream.DEFAULT_MIX, users, seed=seed))
+    purchases = [event for event in corpus if event['event'] == 'purchase']
+    item_views = [event for event in corpus if event['event'] == 'view_item']
+    flatten = beam_processing.FlattenItemViews()
+    inputs = {
+        "messages": corpus,
+        "item_views": item_views,
+        "item_view_rows": [row for event in item_views for row in flatten.process(event)],
+        "purchases": purchases,
+        # Per-user (count, sum, min, max, mean) of a single purchase.
+        "user_stats": [(event['user_id'], (1,) + (event['ecommerce']['purchase']['value'],) * 4) for event in purchases],
+    }
+
+    paths = {}
+    for name, elements in inputs.items():
+        paths[name] = (os.path.join(directory, f"{name}.jsonl"), len(elements))
+        with open(paths[name][0], "w") as f:
+            for element in elements:
+                f.write(json.dumps(element) + "\n")
+    return paths
+
+
+def decode_user_stats(line):
+    user_id, stats = json.loads(line)
+    return user_id, tuple(stats)
+
+
+def read_input(p, name, path):
+    lines = p | f"Read {name}" >> ReadFromText(path)
+    if name == "messages":
+        # Raw messages, as they come from Pub/Sub.
+        return lines
+    if name == "user_stats":
+        return lines | "Decode" >> beam.Map(decode_user_stats)
+    return lines | "Decode" >> beam.Map(json.loads)
+
+
+def route(pcoll):
+    outputs = pcoll | beam.ParDo(beam_processing.ParseAndRouteFn()).with_outputs(*beam_processing.EVENT_TYPES,
+                                                                                  beam_processing.DEAD_LETTER)
+    return [outputs[tag] for tag in beam_processing.EVENT_TYPES + (beam_processing.DEAD_LETTER,)]
+
+
+def whole_graph(pcoll, aggregation_mode):
+    return list(beam_processing.build_pipeline(pcoll, aggregation_mode=aggregation_mode).values())
+
+
+def stages(aggregation_mode, sink_latency):
+    """(name, input name, transform) of every measured stage, each transform returns its output PCollection(s)."""
+    sinks = [(f"sink_{method.lower()}", "item_view_rows",
+              lambda pcoll, method=method: pcoll | beam_processing.FakeBigQuerySink("beam_item_views", method, sink_latency))
+             for method in beam_processing.WRITE_METHODS]
+    return [
+        ("parse_and_route", "messages", route),
+        ("flatten_item_views", "item_views", lambda pcoll: pcoll | beam.ParDo(beam_processing.FlattenItemViews())),
+        ("extract_and_sum_value", "purchases", lambda pcoll: pcoll | beam_processing.ExtractAndSumValue()),
+        ("format_by_row", "user_stats", lambda pcoll: pcoll | beam_processing.FormatByRow()),
+        ("aggregate_purchases", "purchases",
+         lambda pcoll: pcoll | beam_processing.AggregatePurchases(mode=aggregation_mode)),
+        ("pipeline", "messages", lambda pcoll: whole_graph(pcoll, aggregation_mode)),
+    ] + sinks
+
+
+def cpu_time():
+    # Worker processes of the multi_processing mode are children of this process.
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.process_time() + children.ru_utime + children.ru_stime
+
+
+def run_stage(name, path, transform, options):
+    p = beam.Pipeline(options=options)
+    outputs = transform(read_input(p, name, path))
+    # Outputs are counted instead of written, so no sink takes part in the measurement.
+    for i, output in enumerate(outputs if isinstance(outputs, list) else [outputs]):
+        output | f"Count {i}" >> beam.combiners.Count.Globally().without_defaults()
+
+    start, start_cpu = time.perf_counter(), cpu_time()
+    p.run().wait_until_finish()
+    return time.perf_counter() - start, cpu_time() - start_cpu
+
+
+def main(args):
+    start = time.perf_counter()
+    inputs = write_inputs(tempfile.mkdtemp(prefix="beam-benchmark-"), args.events, args.users, args.seed)
+    print(f"Generated {args.events} events in {time.perf_counter() - start:.1f}s")
+
+    results = []
+    for workers in args.direct_num_workers:
+        mode = "in_memory" if workers == 1 else "multi_processing"
+        options = PipelineOptions(runner="DirectRunner", direct_running_mode=mode, direct_num_workers=workers)
+
+        # Reading and decoding each input on its own, subtracted from the stages that consume it.
+        selected = [(stage, name, transform) for stage, name, transform in stages(args.aggregation_mode, args.sink_latency)
+                    if not args.stages or stage in args.stages]
+        baselines = {}
+        for name in {name for _, name, _ in selected}:
+            path, _ = inputs[name]
+            baselines[name] = min(run_stage(name, path, lambda pcoll: pcoll, options) for _ in range(args.repeat))
+
+        for stage, name, transform in selected:
+            path, count = inputs[name]
+            elapsed, cpu = min(run_stage(name, path, transform, options) for _ in range(args.repeat))
+            # Differences of short runs are dominated by noise, CPU time per element is the steadier number.
+            net_elapsed = elapsed - baselines[name][0]
+            net_cpu = max(cpu - baselines[name][1], 0.0)
+            result = {
+                "stage": stage,
+                "direct_num_workers": workers,
+                "elements": count,
+                "elapsed_s": elapsed,
+                "cpu_s": cpu,
+                "read_elapsed_s": baselines[name][0],
+                "read_cpu_s": baselines[name][1],
+                "elements_per_s": count / elapsed,
+                "net_elements_per_s": count / net_elapsed if net_elapsed > 0 else None,
+                "net_cpu_us_per_element": 1e6 * net_cpu / count if count else None,
+            }
+            results.append(result)
+            print(f"{stage:<30} workers={workers:<3} elements={count:<8} "
+                  f"{result['elements_per_s']:>8.0f} elements/s ({result['net_elements_per_s'] or 0:.0f} without reading)  "
+                  f"cpu={net_cpu:.2f}s ({result['net_cpu_us_per_element'] or 0:.1f}us/element) without reading")
+
+    report = {
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "apache_beam": beam.__version__,
+        "cpu_count": os.cpu_count(),
+        "events": args.events,
+        "aggregation_mode": args.aggregation_mode,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=100000, help="Events in the synthetic corpus")
+    parser.add_argument("--users", type=int, default=1000, help="Distinct user_ids in the corpus")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--direct-num-workers", type=int, nargs="+", default=[1],
+                        help="DirectRunner workers, more than 1 runs them as separate processes")
+    parser.add_argument("--aggregation-mode", choices=["global", "fixed", "sliding"],
+                        default=beam_processing.config.aggregation_mode)
+    parser.add_argument("--sink-latency", type=float, default=0.0,
+                        help="Seconds per request of the fake BigQuery sink in the sink_* stages")
+    parser.add_argument("--stages", nargs="+", help="Only run these stages")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per stage, the fastest one is reported")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+
+    main(parser.parse_args())
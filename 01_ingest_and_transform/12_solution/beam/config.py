@@ -14,3 +14,15 @@
 
 project_id = 'poerschmann-hyp-test3'
 location = 'europe-west1'
+
+# Aggregation of purchase values per user: 'global' keeps a running sum, 'fixed' and 'sliding' use event time windows.
+# The windowed modes need an event_datetime close to the time an event is published. Reading from Pub/Sub the
+# watermark follows the publish time, purchases stamped further back than allowed_lateness are dropped.
+aggregation_mode = 'global'
+window_size = 60  # seconds
+window_period = 15  # seconds between the starts of sliding windows
+allowed_lateness = 120  # seconds
+
+# BigQuery write method: 'STREAMING_INSERTS', 'STORAGE_WRITE_API' (exactly-once), 'STORAGE_API_AT_LEAST_ONCE' or 'FILE_LOADS'.
+write_method = 'STREAMING_INSERTS'
+triggering_frequency = 5  # seconds between FILE_LOADS load jobs and STORAGE_WRITE_API commits when streaming
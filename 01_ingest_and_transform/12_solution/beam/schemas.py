@@ -0,0 +1,79 @@
+# Copyright 2023 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Columns of the BigQuery tables written by beam_processing.py, every schema the pipeline uses is derived from here.
+# Only used while the pipeline is built, the Dataflow workers do not need this module.
+
+ITEM_VIEWS = [
+    ("event_datetime", "DATETIME"),
+    ("event", "STRING"),
+    ("user_id", "STRING"),
+    ("client_id", "STRING"),
+    ("page", "STRING"),
+    ("page_previous", "STRING"),
+    ("item_name", "STRING"),
+    ("item_id", "STRING"),
+    ("price", "STRING"),
+    ("item_brand", "STRING"),
+    ("item_category", "STRING"),
+    ("item_category_2", "STRING"),
+    ("item_category_3", "STRING"),
+    ("item_category_4", "STRING"),
+    ("item_variant", "STRING"),
+    ("item_list_name", "STRING"),
+    ("item_list_id", "STRING"),
+    ("quantity", "STRING"),
+]
+
+AGGREGATED = [
+    ("user_id", "STRING"),
+    ("summed_value", "FLOAT"),
+    ("purchase_count", "INTEGER"),
+    ("min_value", "FLOAT"),
+    ("max_value", "FLOAT"),
+    ("mean_value", "FLOAT"),
+]
+
+AGGREGATED_WINDOWED = AGGREGATED + [
+    ("window_start", "DATETIME"),
+    ("window_end", "DATETIME"),
+]
+
+DEAD_LETTER = [
+    ("payload", "STRING"),
+    ("error", "STRING"),
+]
+
+TABLES = {
+    "beam_item_views": ITEM_VIEWS,
+    "beam_aggregated": AGGREGATED,
+    "beam_aggregated_windowed": AGGREGATED_WINDOWED,
+    "beam_dead_letter": DEAD_LETTER,
+}
+
+
+def columns(fields):
+    return [name for name, _ in fields]
+
+
+def table_schema(fields, storage_write_api=False):
+    """The schema as WriteToBigQuery takes it.
+
+    The Storage Write API of the Python SDK has no mapping for DATETIME, those
+    columns are written as TIMESTAMP (UTC) with it.
+    """
+    return {"fields": [{"name": name,
+                        "type": "TIMESTAMP" if storage_write_api and field_type == "DATETIME" else field_type,
+                        "mode": "NULLABLE"}
+                       for name, field_type in fields]}
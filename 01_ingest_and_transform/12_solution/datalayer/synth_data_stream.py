@@ -14,70 +14,308 @@
 
 import random
 import requests
+import datetime
+import gzip
 import json
+import os
+import threading
 import time
 import argparse
 
+from concurrent.futures import ThreadPoolExecutor
+
+from requests.adapters import HTTPAdapter
+
+DATALAYER_DIR = os.path.dirname(os.path.abspath(__file__))
+
+EVENT_TYPES = ("view_item", "add_to_cart", "purchase", "purchase_anomaly")
+
+# Share of each event type, same split as the original one-event-every-two-seconds stream.
+DEFAULT_MIX = {"view_item": 1 / 3, "add_to_cart": 1 / 3, "purchase": 0.95 - 2 / 3, "purchase_anomaly": 0.05}
+
+# Upper bounds (ms) of the latency histogram buckets printed after a load run.
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+
+def load_fixtures(directory=DATALAYER_DIR):
+    """Reads every event fixture once, events are cloned from these in memory."""
+    fixtures = {}
+    for event_type in EVENT_TYPES:
+        with open(os.path.join(directory, f"{event_type}.json")) as f:
+            fixtures[event_type] = json.load(f)
+    return fixtures
+
+
+def make_event(fixtures, event_type, uid):
+    # Only the top level is copied, nested fixture parts are shared and never modified.
+    payload = dict(fixtures[event_type])
+    payload['user_id'] = uid
+    return payload
+
+
+def main(endpoint, fixtures=None):
+    if fixtures is None:
+        fixtures = load_fixtures()
 
-def main(endpoint):
     draw = round(random.uniform(0, 1), 2)
 
     uid = f'UID0000{int(round(random.uniform(0, 5), 0))}'
 
     if 0 <= draw < 1 / 3:
-        # get view payload
-        view_item_f = open('./datalayer/view_item.json')
-        view_item_payload = json.load(view_item_f)
-
-        view_item_payload['user_id'] = uid
-
         # send view
-        r = requests.post(endpoint, json=view_item_payload)
+        r = requests.post(endpoint, json=make_event(fixtures, "view_item", uid))
 
     elif 1 / 3 <= draw < 2 / 3:
-        # get add to cart payload
-        add_to_cart_f = open('./datalayer/add_to_cart.json')
-        add_to_cart_payload = json.load(add_to_cart_f)
-
-        add_to_cart_payload['user_id'] = uid
-
         # send add to cart
-        r = requests.post(endpoint, json=add_to_cart_payload)
+        r = requests.post(endpoint, json=make_event(fixtures, "add_to_cart", uid))
 
     else:
         # decide between anomaly or no anomaly
         if draw < 0.95:
-            # get payload
-            purchase_f = open('./datalayer/purchase.json')
-            purchase_payload = json.load(purchase_f)
+            r = requests.post(endpoint, json=make_event(fixtures, "purchase", uid))
+        else:
+            r = requests.post(endpoint, json=make_event(fixtures, "purchase_anomaly", uid))
+
+    # print(r.text)
+    print(f'{time.time()} -- {r.status_code}')
+
+
+def parse_mix(mix):
+    """Parses 'view_item=1,purchase=2' into normalised weights."""
+    weights = {}
+    for part in mix.split(","):
+        event_type, weight = part.split("=")
+        if event_type not in EVENT_TYPES:
+            raise ValueError(f"Unknown event type '{event_type}', expected one of {EVENT_TYPES}")
+        weights[event_type] = float(weight)
+
+    total = sum(weights.values())
+    return {event_type: weight / total for event_type, weight in weights.items()}
+
+
+class LoadStats:
+    """Thread-safe counters of a load run."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.errors = 0
+        self.status_codes = {}
+        self.latencies_ms = []
+
+    def record(self, status_code, latency_ms):
+        with self.lock:
+            self.sent += 1
+            self.status_codes[status_code] = self.status_codes.get(status_code, 0) + 1
+            self.latencies_ms.append(latency_ms)
+            if status_code is None or status_code >= 400:
+                self.errors += 1
+
+    def summary(self, elapsed):
+        latencies = sorted(self.latencies_ms)
+
+        def percentile(q):
+            return latencies[min(len(latencies) - 1, int(q / 100 * len(latencies)))] if latencies else 0.0
+
+        print(f"\nSent {self.sent} events in {elapsed:.1f}s -- {self.sent / elapsed:.1f} events/s")
+        print(f"Errors: {self.errors}  Status codes: {self.status_codes}")
+        print(f"Latency p50={percentile(50):.1f}ms p95={percentile(95):.1f}ms p99={percentile(99):.1f}ms max={percentile(100):.1f}ms")
+
+        lower = 0
+        for upper in LATENCY_BUCKETS_MS + (float("inf"),):
+            count = sum(1 for latency in latencies if lower <= latency < upper)
+            bar = "#" * int(50 * count / len(latencies)) if latencies else ""
+            print(f"  {lower:>6}-{upper:<6} ms {count:>8} {bar}")
+            lower = upper
+
 
-            purchase_payload['user_id'] = uid
+def paced(events, rate):
+    """Schedules events at a fixed `rate` per second, 0 or None sends them as fast as possible."""
+    for i, payload in enumerate(events):
+        yield (i / rate if rate else None), payload
 
-            # send request
-            r = requests.post(endpoint, json=purchase_payload)
+
+def run_load(endpoint, schedule, concurrency):
+    """Sends the (offset in seconds, payload) pairs of `schedule` from `concurrency` threads.
+
+    Connections are kept alive and pooled, so every thread reuses its socket.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    stats = LoadStats()
+    # Limits the events handed to the pool, so a slow endpoint shows up as a lower achieved rate.
+    in_flight = threading.BoundedSemaphore(concurrency * 2)
+
+    def send(payload):
+        start = time.perf_counter()
+        try:
+            status_code = session.post(endpoint, json=payload).status_code
+        except requests.RequestException as e:
+            print(f"Request failed: {e}")
+            status_code = None
+        finally:
+            in_flight.release()
+        stats.record(status_code, (time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for offset, payload in schedule:
+            if offset is not None:
+                delay = start + offset - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            in_flight.acquire()
+            executor.submit(send, payload)
+    elapsed = time.perf_counter() - start
+
+    stats.summary(elapsed)
+    return stats
+
+
+def generate_load_events(fixtures, mix, users, count=None, duration=None, rate=None, seed=None):
+    """Yields cloned fixture events until `count` events or `duration` seconds at `rate` are reached."""
+    rng = random.Random(seed)
+    event_types = list(mix)
+    weights = [mix[event_type] for event_type in event_types]
+
+    if count is None and duration is not None and rate:
+        count = int(duration * rate)
+
+    i = 0
+    while count is None or i < count:
+        event_type = rng.choices(event_types, weights)[0]
+        yield make_event(fixtures, event_type, f'UID{rng.randrange(users):05d}')
+        i += 1
+
+
+def make_corpus_event(fixtures, event_type, rng, users, event_time, sequence):
+    """A fixture event with randomised user, timestamp, items and prices."""
+    fixture = fixtures[event_type]
+    user = rng.randrange(users)
+
+    event = dict(fixture)
+    event['event_datetime'] = event_time.strftime("%Y-%m-%d %H:%M:%S")
+    event['user_id'] = f'UID{user:05d}'
+    event['client_id'] = f'CID{user:05d}'
+
+    if event_type in ("view_item", "add_to_cart"):
+        item = dict(fixture['ecommerce']['items'][0])
+        item['price'] = round(rng.uniform(5, 100), 2)
+        item['quantity'] = rng.randint(1, 3)
+        event['ecommerce'] = {'items': [item]}
+    else:
+        purchase = dict(fixture['ecommerce']['purchase'])
+        if event_type == "purchase_anomaly":
+            value = rng.uniform(100000, 10000000)
         else:
-            # get payload
-            purchase_anomaly_f = open('./datalayer/purchase_anomaly.json')
-            purchase_anomaly_payload = json.load(purchase_anomaly_f)
+            value = max(1.0, rng.gauss(35.43, 10))
+        purchase['transaction_id'] = f'T{sequence:010d}'
+        purchase['value'] = round(value, 2)
+        purchase['tax'] = round(value * rng.uniform(0.12, 0.16), 2)
+        purchase['shipping'] = rng.choice([0.0, 4.99, 5.99, 9.99])
+        event['ecommerce'] = {'purchase': purchase}
 
-            purchase_anomaly_payload['user_id'] = uid
+    return event
 
-            # send request
-            r = requests.post(endpoint, json=purchase_anomaly_payload)
 
-    # print(r.text)
-    print(f'{time.time()} -- {r.status_code}')
+def generate_corpus(count, fixtures, mix, users, seed=0, start_time="2023-01-01 00:00:00", events_per_second=100):
+    """Yields `count` seeded events, the same seed always gives the same sequence."""
+    rng = random.Random(seed)
+    event_types = list(mix)
+    weights = [mix[event_type] for event_type in event_types]
+    event_time = datetime.datetime.strptime(start_time, "%Y-%m-%d %H:%M:%S")
+
+    for i in range(count):
+        # Poisson arrivals, so replaying at the recorded pace gives realistic bursts.
+        event_time += datetime.timedelta(seconds=rng.expovariate(events_per_second))
+        event_type = rng.choices(event_types, weights)[0]
+        yield make_corpus_event(fixtures, event_type, rng, users, event_time, i)
+
+
+def write_corpus(path, count, fixtures, mix, users, seed=0, start_time="2023-01-01 00:00:00", events_per_second=100):
+    """Writes `count` seeded events as newline-delimited JSON, gzip compressed if `path` ends in .gz.
+
+    Events are written one at a time so memory use does not grow with `count`.
+    """
+    open_fn = gzip.open if path.endswith(".gz") else open
+    start = time.time()
+    with open_fn(path, "wt") as f:
+        events = generate_corpus(count, fixtures, mix, users, seed, start_time, events_per_second)
+        for i, event in enumerate(events):
+            f.write(json.dumps(event) + "\n")
+
+            if (i + 1) % 1000000 == 0:
+                print(f"{i + 1} events written")
+
+    print(f"Wrote {count} events to {path} in {time.time() - start:.1f}s")
+
+
+def read_corpus(path):
+    """Yields the events of a corpus file one by one."""
+    open_fn = gzip.open if path.endswith(".gz") else open
+    with open_fn(path, "rt") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def recorded_pace(events, speedup=1.0):
+    """Schedules events by the gaps between their event_datetime, divided by `speedup`."""
+    first = None
+    for event in events:
+        event_time = datetime.datetime.strptime(event['event_datetime'], "%Y-%m-%d %H:%M:%S")
+        if first is None:
+            first = event_time
+        yield (event_time - first).total_seconds() / speedup, event
 
 
 if __name__ == "__main__":
     # Parse Arguments
     parser = argparse.ArgumentParser()
     parser.add_argument("--endpoint", help="Target Endpoint")
+    parser.add_argument("--rate", type=float, help="Load mode: target events per second, 0 sends as fast as possible")
+    parser.add_argument("--duration", type=float, default=60, help="Load mode: seconds to run at --rate")
+    parser.add_argument("--count", type=int, help="Load mode: number of events to send, overrides --duration")
+    parser.add_argument("--concurrency", type=int, default=16, help="Load mode: parallel senders / pooled connections")
+    parser.add_argument("--mix", help="Load mode: event weights, e.g. view_item=1,add_to_cart=1,purchase=0.85,purchase_anomaly=0.15")
+    parser.add_argument("--users", type=int, default=6, help="Load mode: number of distinct user_ids")
+    parser.add_argument("--seed", type=int, help="Load mode: random seed for the event sequence")
+    parser.add_argument("--write-corpus", metavar="PATH", help="Write --count seeded events to a .jsonl or .jsonl.gz file and exit")
+    parser.add_argument("--corpus-rate", type=float, default=100, help="Corpus: average events per second of event time")
+    parser.add_argument("--replay", metavar="PATH", help="Send the events of a corpus file at --rate, or at their recorded pace if --rate is omitted")
+    parser.add_argument("--speedup", type=float, default=1.0, help="Replay: factor applied to the recorded pace")
 
     args = parser.parse_args()
 
+    fixtures = load_fixtures()
+    mix = parse_mix(args.mix) if args.mix else DEFAULT_MIX
+
+    if args.write_corpus:
+        if args.count is None:
+            parser.error("--write-corpus needs --count")
+        write_corpus(args.write_corpus, args.count, fixtures, mix, args.users,
+                     seed=args.seed or 0, events_per_second=args.corpus_rate)
+        raise SystemExit()
+
+    if args.endpoint is None:
+        parser.error("--endpoint is required")
     endpoint = args.endpoint + '/json'
 
-    while True:
-        main(endpoint)
-        time.sleep(2)
+    if args.replay:
+        events = read_corpus(args.replay)
+        if args.count is not None:
+            events = (event for _, event in zip(range(args.count), events))
+        schedule = paced(events, args.rate) if args.rate is not None else recorded_pace(events, args.speedup)
+        run_load(endpoint, schedule, args.concurrency)
+    elif args.rate is not None:
+        if args.count is None and not args.rate:
+            parser.error("--rate 0 needs --count")
+        events = generate_load_events(fixtures, mix, args.users, count=args.count,
+                                      duration=args.duration, rate=args.rate, seed=args.seed)
+        run_load(endpoint, paced(events, args.rate), args.concurrency)
+    else:
+        while True:
+            main(endpoint, fixtures)
+            time.sleep(2)
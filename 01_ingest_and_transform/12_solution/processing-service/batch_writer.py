@@ -0,0 +1,188 @@
+# Copyright 2023 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import threading
+import time
+
+from concurrent.futures import Future
+
+
+class BatchWriter:
+    """Buffers rows from concurrent requests and streams them to BigQuery in batches.
+
+    Every submitted row gets a Future that resolves once the batch containing it
+    has been written. The Future's result is the list of insert errors for that
+    row only (empty on success), so each Pub/Sub push can be acked or rejected
+    on its own.
+
+    `client` is anything with an `insert_rows_json(table_id, rows)` method,
+    e.g. `bigquery.Client` or `LocalSink`.
+    """
+
+    def __init__(self, client, table_id, max_rows=500, max_bytes=5 * 1024 * 1024, max_latency=0.05):
+        self.client = client
+        self.table_id = table_id
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_latency = max_latency
+
+        self._lock = threading.Condition()
+        self._pending = []
+        self._bytes = 0
+        self._closed = False
+        self._thread = None
+
+    def submit(self, record):
+        """Queue a single row and return a Future for its insert errors."""
+        size = len(json.dumps(record))
+        future = Future()
+
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("BatchWriter is closed")
+            if self._thread is None:
+                # Created by the first row, so the writer runs in the process that serves the pushes.
+                self._thread = threading.Thread(target=self._run, name="bq-batch-writer", daemon=True)
+                self._thread.start()
+
+            self._pending.append((record, future, size, time.monotonic()))
+            self._bytes += size
+
+            # With an empty buffer the writer sleeps without a deadline: the first row starts its
+            # max_latency clock, a full buffer is written without waiting for it.
+            if len(self._pending) == 1 or self._full():
+                self._lock.notify()
+
+        return future
+
+    def insert(self, record, timeout=None):
+        """Queue a single row and block until its batch has been written."""
+        return self.submit(record).result(timeout=timeout)
+
+    def flush(self):
+        """Write everything buffered so far from the calling thread."""
+        while True:
+            with self._lock:
+                if not self._pending:
+                    return
+                rows, futures = self._take()
+            self._write(rows, futures)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._lock.notify()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def _full(self):
+        return len(self._pending) >= self.max_rows or self._bytes >= self.max_bytes
+
+    def _take(self):
+        # At most max_rows rows and max_bytes bytes, the limits of one insert_rows_json request.
+        # The rest stays buffered for the next batch.
+        count, size = 0, 0
+        for _, _, row_size, _ in self._pending:
+            if count and (count >= self.max_rows or size + row_size > self.max_bytes):
+                break
+            count += 1
+            size += row_size
+
+        batch, self._pending = self._pending[:count], self._pending[count:]
+        self._bytes -= size
+        return [entry[0] for entry in batch], [entry[1] for entry in batch]
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._closed:
+                    if self._pending:
+                        if self._full():
+                            break
+                        remaining = self._pending[0][3] + self.max_latency - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._lock.wait(remaining)
+                    else:
+                        self._lock.wait()
+                if self._closed:
+                    return
+                rows, futures = self._take()
+
+            self._write(rows, futures)
+
+    def _write(self, rows, futures):
+        if not rows:
+            return
+
+        try:
+            # Skip invalid rows so a single bad event does not fail its neighbours in the batch.
+            errors = self.client.insert_rows_json(self.table_id, rows, skip_invalid_rows=True)  # Make an API request.
+        except Exception as e:
+            # The whole batch failed, every waiting request has to be retried by Pub/Sub.
+            print(f"Batch insert of {len(rows)} rows failed: {e}")
+            for future in futures:
+                future.set_exception(e)
+            return
+
+        row_errors = [[] for _ in rows]
+        for error in errors:
+            row_errors[error["index"]].append(error)
+
+        print(f"{time.time()} Inserted batch of {len(rows)} rows with {len(errors)} errors.")
+        for future, error in zip(futures, row_errors):
+            future.set_result(error)
+
+
+class LocalSink:
+    """In-memory stand-in for `bigquery.Client.insert_rows_json`.
+
+    Rows for which `reject(row)` returns a reason are reported back in the
+    same format as the BigQuery streaming API instead of being stored.
+    """
+
+    def __init__(self, reject=None, latency=0.0):
+        self.reject = reject
+        self.latency = latency
+        self.tables = {}
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def insert_rows_json(self, table_id, rows, skip_invalid_rows=False):
+        if self.latency:
+            time.sleep(self.latency)
+
+        errors = []
+        accepted = []
+        for index, row in enumerate(rows):
+            reason = self.reject(row) if self.reject else None
+            if reason:
+                errors.append({"index": index, "errors": [{"reason": "invalid", "message": reason}]})
+            else:
+                accepted.append(row)
+
+        if errors and not skip_invalid_rows:
+            # Like BigQuery, a single invalid row stops the whole request.
+            invalid = {error["index"] for error in errors}
+            errors += [{"index": index, "errors": [{"reason": "stopped", "message": ""}]}
+                       for index in range(len(rows)) if index not in invalid]
+            errors.sort(key=lambda error: error["index"])
+            accepted = []
+
+        with self._lock:
+            self.calls += 1
+            self.tables.setdefault(table_id, []).extend(accepted)
+        return errors
@@ -16,3 +16,8 @@ project_id = 'poerschmann-hyp-test3'
 location = 'europe-west1'
 bq_dataset = 'ecommerce_sink'
 bq_table = 'cloud_run'
+
+# Micro-batching of streaming inserts, a batch is written as soon as one limit is reached.
+batch_max_rows = 500
+batch_max_bytes = 5 * 1024 * 1024
+batch_max_latency = 0.05  # seconds
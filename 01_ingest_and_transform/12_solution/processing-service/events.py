@@ -0,0 +1,28 @@
+# Copyright 2023 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import base64
+import datetime
+import json
+
+
+def decode_message(envelope):
+    """Decodes the event carried by a Pub/Sub push envelope and adds its weekday."""
+    ps_message = envelope['message']
+
+    record = base64.b64decode(ps_message["data"]).decode("utf-8").strip()
+    record = json.loads(record)
+
+    record["weekday"] = datetime.datetime.strptime(record["event_datetime"], "%Y-%m-%d %H:%M:%S").strftime('%A')
+    return record
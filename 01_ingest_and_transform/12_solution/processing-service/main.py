@@ -14,17 +14,26 @@
 
 import os
 import time
-import base64
-import json
-import datetime
 import config
+import events
 
 from flask import Flask, request
 
 from google.cloud import bigquery
 
+from batch_writer import BatchWriter
+
 app = Flask(__name__)
 
+# One long-lived client and writer per worker, rows of concurrent pushes are inserted together.
+client = bigquery.Client(project=config.project_id, location=config.location)
+table_id = config.project_id + '.' + config.bq_dataset + '.' + config.bq_table
+
+writer = BatchWriter(client, table_id,
+                     max_rows=config.batch_max_rows,
+                     max_bytes=config.batch_max_bytes,
+                     max_latency=config.batch_max_latency)
+
 
 @app.route("/hw", methods=['GET', 'POST'])
 def hello_world():
@@ -43,19 +52,10 @@ def index():
         print(f"error: {msg}")
         return f"Bad Request: {msg}", 400
 
-    ps_message = envelope['message']
-
-    record = base64.b64decode(ps_message["data"]).decode("utf-8").strip()
-    record = json.loads(record)
-
-    record["weekday"] = datetime.datetime.strptime(record["event_datetime"], "%Y-%m-%d %H:%M:%S").strftime('%A')
-
-    rows_to_insert = [record]
-
-    client = bigquery.Client(project=config.project_id, location=config.location)
-    table_id = config.project_id + '.' + config.bq_dataset + '.' + config.bq_table
+    record = events.decode_message(envelope)
 
-    errors = client.insert_rows_json(table_id, rows_to_insert)  # Make an API request.
+    # Blocks until the batch containing this row has been written, so the push is only acked once it is stored.
+    errors = writer.insert(record)
     if errors == []:
         print(f"{time.time()} New rows have been added.")
         return ("", 204)
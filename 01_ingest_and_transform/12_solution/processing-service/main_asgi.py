@@ -0,0 +1,69 @@
+# Copyright 2023 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# ASGI variant of main.py with the same routes and responses.
+# Run with: uvicorn main_asgi:app --host 0.0.0.0 --port $PORT
+
+import asyncio
+import time
+from typing import Optional
+
+import config
+import events
+
+from fastapi import FastAPI, Request
+from fastapi.responses import HTMLResponse, Response
+
+from google.cloud import bigquery
+
+from batch_writer import BatchWriter
+
+app = FastAPI()
+
+client = bigquery.Client(project=config.project_id, location=config.location)
+table_id = config.project_id + '.' + config.bq_dataset + '.' + config.bq_table
+
+writer = BatchWriter(client, table_id,
+                     max_rows=config.batch_max_rows,
+                     max_bytes=config.batch_max_bytes,
+                     max_latency=config.batch_max_latency)
+
+
+@app.api_route("/hw", methods=["GET", "POST"], response_class=HTMLResponse)
+async def hello_world(world: Optional[str] = None):
+    return f"Hello {world}!"
+
+
+@app.post("/")
+async def index(request: Request):
+    try:
+        envelope = await request.json()
+    except ValueError:
+        envelope = None
+
+    if not envelope:
+        msg = "no Pub/Sub message received"
+        print(f"error: {msg}")
+        return HTMLResponse(f"Bad Request: {msg}", status_code=400)
+
+    record = events.decode_message(envelope)
+
+    # Waiting on the batch does not hold a thread, any number of pushes can share one insert.
+    errors = await asyncio.wrap_future(writer.submit(record))
+    if errors == []:
+        print(f"{time.time()} New rows have been added.")
+        return Response(status_code=204)
+    else:
+        print("Encountered errors while inserting rows: {}".format(errors))
+        return HTMLResponse(f"Bad Request: {envelope}", status_code=400)
@@ -0,0 +1,108 @@
+# Copyright 2023 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Runs without GCP: python -m unittest test_batch_writer
+
+import time
+import unittest
+
+from concurrent.futures import ThreadPoolExecutor
+
+from batch_writer import BatchWriter, LocalSink
+
+TABLE_ID = "project.dataset.ecommerce_events"
+
+
+def event(number, **fields):
+    return {"event_type": "purchase", "event_number": number, **fields}
+
+
+class BatchWriterTest(unittest.TestCase):
+
+    def writer(self, sink, **kwargs):
+        writer = BatchWriter(sink, TABLE_ID, **kwargs)
+        self.addCleanup(writer.close)
+        return writer
+
+    def test_concurrent_rows_share_inserts(self):
+        sink = LocalSink(latency=0.01)
+        writer = self.writer(sink, max_rows=50, max_latency=0.02)
+
+        with ThreadPoolExecutor(max_workers=100) as pool:
+            results = list(pool.map(lambda number: writer.insert(event(number), timeout=5), range(200)))
+
+        self.assertEqual(results, [[]] * 200)
+        self.assertEqual(sorted(row["event_number"] for row in sink.tables[TABLE_ID]), list(range(200)))
+        self.assertLessEqual(sink.calls, 20)
+
+    def test_batches_are_limited_to_max_rows(self):
+        sink = LocalSink()
+        writer = self.writer(sink, max_rows=3, max_latency=10)
+
+        futures = [writer.submit(event(number)) for number in range(7)]
+        for future in futures[:6]:
+            self.assertEqual(future.result(timeout=5), [])
+        # The seventh row is alone in the buffer and waits for max_latency, flush writes it now.
+        writer.flush()
+
+        self.assertEqual(futures[6].result(timeout=5), [])
+        self.assertEqual(sink.calls, 3)
+
+    def test_rejected_row_fails_only_itself(self):
+        sink = LocalSink(reject=lambda row: "no user" if row.get("user_id") is None else None)
+        writer = self.writer(sink, max_rows=3, max_latency=10)
+
+        futures = [writer.submit(event(0, user_id=1)), writer.submit(event(1)), writer.submit(event(2, user_id=2))]
+        results = [future.result(timeout=5) for future in futures]
+
+        self.assertEqual(results[0], [])
+        self.assertEqual(results[1][0]["errors"][0]["message"], "no user")
+        self.assertEqual(results[2], [])
+        self.assertEqual([row["event_number"] for row in sink.tables[TABLE_ID]], [0, 2])
+
+    def test_failed_insert_fails_the_batch(self):
+        class BrokenSink:
+            def insert_rows_json(self, table_id, rows, skip_invalid_rows=False):
+                raise ConnectionError("BigQuery unavailable")
+
+        writer = self.writer(BrokenSink(), max_rows=2, max_latency=10)
+        futures = [writer.submit(event(0)), writer.submit(event(1))]
+
+        for future in futures:
+            with self.assertRaises(ConnectionError):
+                future.result(timeout=5)
+
+    def test_partial_batch_is_written_after_max_latency(self):
+        sink = LocalSink()
+        writer = self.writer(sink, max_rows=500, max_latency=0.05)
+
+        start = time.monotonic()
+        self.assertEqual(writer.insert(event(0), timeout=5), [])
+
+        self.assertGreaterEqual(time.monotonic() - start, 0.04)
+        self.assertEqual(sink.calls, 1)
+
+    def test_single_row_after_empty_buffer(self):
+        sink = LocalSink()
+        writer = self.writer(sink, max_rows=500, max_latency=0.05)
+
+        self.assertEqual(writer.insert(event(0), timeout=5), [])
+        # The writer has drained the buffer and waits without a deadline, the next row has to wake it.
+        time.sleep(0.1)
+        self.assertEqual(writer.insert(event(1), timeout=1), [])
+        self.assertEqual(sink.calls, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
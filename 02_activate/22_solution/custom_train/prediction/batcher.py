@@ -0,0 +1,156 @@
+# Copyright 2023 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import collections
+import time
+
+import numpy as np
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class DynamicBatcher:
+    """Collects the instances of concurrent requests into one predict call.
+
+    A background task takes queued requests as soon as they add up to
+    `max_batch_size` instances or the oldest one has waited `max_wait` seconds,
+    predicts them as one array in a worker thread and hands every request its
+    slice of the outputs. Requests larger than `max_batch_size` are predicted on
+    their own. More than `max_queue` queued instances raise QueueFullError.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=64, max_wait=0.002, max_queue=4096):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        # (instances, future, enqueue time) of the waiting requests.
+        self._pending = collections.deque()
+        self._queued = 0
+        self._wakeup = None
+        self._loop = None
+        self.counters = collections.Counter()
+
+    async def predict(self, data):
+        loop = asyncio.get_event_loop()
+        if self._loop is not loop:
+            # Created on first use, asyncio objects belong to the loop that is running then.
+            self._loop = loop
+            self._wakeup = asyncio.Event()
+            loop.create_task(self._run())
+        if self._queued + len(data) > self.max_queue:
+            self.counters["rejected"] += 1
+            raise QueueFullError(f"{self._queued} instances are queued already")
+
+        future = loop.create_future()
+        self._pending.append((data, future, time.perf_counter()))
+        self._queued += len(data)
+        self.counters["max_queue_depth"] = max(self.counters["max_queue_depth"], self._queued)
+        self._wakeup.set()
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._pending:
+                batch = []
+                try:
+                    full = await self._fill()
+                    batch = self._take()
+                    await self._predict(loop, batch, full)
+                except Exception as e:
+                    # Only the requests of this batch fail, the task keeps serving the next ones.
+                    if not batch:
+                        batch = [self._pending.popleft()]
+                        self._queued -= len(batch[0][0])
+                    for _, future, _ in batch:
+                        if not future.done():
+                            future.set_exception(e)
+
+    async def _fill(self):
+        """Waits until a full batch is queued or the oldest request is due, returns whether the batch is full."""
+        deadline = self._pending[0][2] + self.max_wait
+        while self._queued < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                return False
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+    def _take(self):
+        batch = [self._pending.popleft()]
+        size = len(batch[0][0])
+        while self._pending and size + len(self._pending[0][0]) <= self.max_batch_size:
+            batch.append(self._pending.popleft())
+            size += len(batch[-1][0])
+        self._queued -= size
+        return batch
+
+    async def _predict(self, loop, batch, full):
+        start = time.perf_counter()
+        data = np.concatenate([instances for instances, _, _ in batch]) if len(batch) > 1 else batch[0][0]
+        self.counters["batches"] += 1
+        self.counters["full_batches" if full else "timed_out_batches"] += 1
+        self.counters["requests"] += len(batch)
+        self.counters["instances"] += len(data)
+        self.counters["max_batch_instances"] = max(self.counters["max_batch_instances"], len(data))
+        self.counters["wait_us"] += int(1e6 * sum(start - enqueued for _, _, enqueued in batch))
+
+        try:
+            # In a thread, so requests keep being queued for the next batch meanwhile.
+            outputs = await loop.run_in_executor(None, self.predict_fn, data)
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.counters["predict_us"] += int(1e6 * (time.perf_counter() - start))
+
+        offset = 0
+        for instances, future, _ in batch:
+            # Requests whose client went away are cancelled already.
+            if not future.done():
+                future.set_result(outputs[offset:offset + len(instances)])
+            offset += len(instances)
+
+    def metrics(self):
+        counters = self.counters
+        batches = counters["batches"]
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "max_queue": self.max_queue,
+            "queue_depth": self._queued,
+            "queued_requests": len(self._pending),
+            "max_queue_depth": counters["max_queue_depth"],
+            "requests": counters["requests"],
+            "instances": counters["instances"],
+            "rejected": counters["rejected"],
+            "batches": batches,
+            "full_batches": counters["full_batches"],
+            "timed_out_batches": counters["timed_out_batches"],
+            "max_batch_instances": counters["max_batch_instances"],
+            "mean_batch_instances": counters["instances"] / batches if batches else None,
+            "mean_wait_ms": counters["wait_us"] / 1000 / counters["requests"] if batches else None,
+            "mean_predict_ms": counters["predict_us"] / 1000 / batches if batches else None,
+        }
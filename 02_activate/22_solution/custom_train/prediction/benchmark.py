@@ -0,0 +1,176 @@
+# Copyright 2023 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Load test of the prediction server, run in-process against a locally trained stand-in model.
+#
+# python3 benchmark.py --concurrency 1 8 32 --batch-sizes 1 16 256 --output results.json
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+import httpx
+import sklearn
+from joblib import dump
+from sklearn.tree import DecisionTreeClassifier
+
+
+def make_instances(rng, n, anomaly_rate=0.05):
+    """Purchases shaped like datalayer/purchase.json and purchase_anomaly.json."""
+    data = np.column_stack([
+        rng.normal(4.90, 1.0, n),
+        rng.normal(5.99, 1.0, n),
+        rng.normal(35.43, 10.0, n),
+    ])
+    labels = rng.random(n) < anomaly_rate
+    data[labels, 2] = rng.normal(1000000.10, 1000.0, labels.sum())
+    return data, labels
+
+
+def train_stand_in_model(directory, seed):
+    """Writes model.joblib and the flat tree model.npz like trainer/train.py, returns their directory."""
+    sys.path.insert(0, TRAINER_DIR)
+    import export_tree
+
+    rng = np.random.default_rng(seed)
+    data, labels = make_instances(rng, 10000)
+    model = DecisionTreeClassifier(random_state=seed)
+    model.fit(data, labels)
+    dump(model, os.path.join(directory, "model.joblib"))
+    validation_data, _ = make_instances(rng, 10000)
+    export_tree.export_tree(model, os.path.join(directory, "model.npz"), validation_data)
+
+
+TRAINER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "trainer")
+
+
+def percentile(latencies, q):
+    return float(np.percentile(latencies, q)) * 1000 if latencies else None
+
+
+async def run_case(app, route, concurrency, batch_size, requests, payloads):
+    latencies = []
+    errors = 0
+    sent = 0
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+
+        async def worker():
+            nonlocal errors, sent
+            while sent < requests:
+                payload = payloads[sent % len(payloads)]
+                sent += 1
+                start = time.perf_counter()
+                response = await client.post(route, json=payload)
+                latencies.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+
+    return {
+        "route": route,
+        "concurrency": concurrency,
+        "batch_size": batch_size,
+        "requests": len(latencies),
+        "errors": errors,
+        "elapsed_s": elapsed,
+        "requests_per_s": len(latencies) / elapsed,
+        "instances_per_s": len(latencies) * batch_size / elapsed,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+    }
+
+
+def main(args):
+    model_dir = tempfile.mkdtemp(prefix="prediction-benchmark-")
+    if args.model_path is None:
+        train_stand_in_model(model_dir, args.seed)
+        args.model_path = os.path.join(model_dir, f"model.{args.model_format}")
+
+    # Point main.py to the local artifact instead of GCS.
+    os.environ["MODEL_PATH"] = args.model_path
+    os.environ["MODEL_FORMAT"] = os.path.splitext(args.model_path)[1].lstrip(".")
+    if args.batching:
+        os.environ["BATCHING"] = "true"
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import main as server
+    # The server loads the model in the background, requests before that would only measure 503s.
+    server.store.wait()
+
+    rng = np.random.default_rng(args.seed)
+    routes = [server.method] if args.path == "numpy" else [server.method + "_dataframe"] if args.path == "dataframe" \
+        else [server.method, server.method + "_dataframe"]
+
+    results = []
+    for batch_size in args.batch_sizes:
+        # A fixed set of distinct payloads, so JSON encoding is not part of the measurement loop.
+        payloads = []
+        for _ in range(16):
+            data, _ = make_instances(rng, batch_size)
+            payloads.append({"instances": [dict(zip(server.FEATURES, row)) for row in data.tolist()]})
+
+        for concurrency in args.concurrency:
+            for route in routes:
+                # Warm-up round, not reported.
+                asyncio.run(run_case(server.app, route, concurrency, batch_size, concurrency, payloads))
+                result = asyncio.run(run_case(server.app, route, concurrency, batch_size, args.requests, payloads))
+                results.append(result)
+                print(f"{route:<22} concurrency={concurrency:<4} batch={batch_size:<6} "
+                      f"p50={result['p50_ms']:.2f}ms p95={result['p95_ms']:.2f}ms p99={result['p99_ms']:.2f}ms "
+                      f"{result['requests_per_s']:.0f} req/s {result['instances_per_s']:.0f} inst/s "
+                      f"errors={result['errors']}")
+
+    report = {
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "scikit-learn": sklearn.__version__,
+        "model_path": args.model_path,
+        "model_format": os.environ["MODEL_FORMAT"],
+        "requests_per_case": args.requests,
+        "batching": server.dynamic_batcher.metrics() if server.dynamic_batcher else None,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32], help="Concurrent clients")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 16, 256], help="Instances per request")
+    parser.add_argument("--requests", type=int, default=2000, help="Requests per case")
+    parser.add_argument("--path", choices=["numpy", "dataframe", "both"], default="both", help="Prediction path(s) to measure")
+    parser.add_argument("--batching", action="store_true",
+                        help="Enable dynamic batching of /predict, configured by MAX_BATCH_SIZE and MAX_BATCH_WAIT_MS")
+    parser.add_argument("--model-path", help="Existing model.joblib or model.npz, a stand-in model is trained if omitted")
+    parser.add_argument("--model-format", choices=["npz", "joblib"], default="npz",
+                        help="Artifact of the stand-in model to serve")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+
+    main(parser.parse_args())
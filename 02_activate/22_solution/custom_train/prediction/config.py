@@ -14,4 +14,20 @@
 
 
 PROJECT_ID="<project-id>"
-REGION="europe-west1"
\ No newline at end of file
+REGION="europe-west1"
+# Local copy of the downloaded model versions, kept across restarts of the server.
+MODEL_CACHE_DIR="/tmp/model_cache"
+# Seconds between checks for a new model version, 0 loads the model once.
+MODEL_POLL_INTERVAL=60
+
+# Dynamic batching of concurrent /predict requests, the limits and queue depth are reported on /metrics.
+BATCHING=False
+# Instances per predict call, a request with more instances is predicted on its own.
+MAX_BATCH_SIZE=256
+# Milliseconds the oldest queued request waits for others to join its batch.
+MAX_BATCH_WAIT_MS=2
+# Queued instances beyond which /predict answers 503.
+MAX_QUEUE=8192
+
+# Model artifact to serve, "npz" (flat tree, no scikit-learn needed) or "joblib".
+MODEL_FORMAT="npz"
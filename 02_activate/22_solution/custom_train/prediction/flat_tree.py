@@ -0,0 +1,93 @@
+# Copyright 2023 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+
+
+class FlatTree:
+    """Decision tree exported by trainer/export_tree.py, evaluated with NumPy only.
+
+    Features are compared as float32 like scikit-learn does, so predictions
+    match the original DecisionTreeClassifier exactly. Batches of up to
+    SMALL_BATCH rows walk the tree row by row, larger ones descend it together
+    one level per step, with rows that reached a leaf dropping out.
+    """
+
+    # Below this many rows the per-level NumPy calls cost more than walking the rows in Python.
+    SMALL_BATCH = 64
+
+    def __init__(self, arrays):
+        self.feature = arrays["feature"].astype(np.intp)
+        self.threshold = arrays["threshold"]
+        self.left = arrays["left"].astype(np.intp)
+        self.right = arrays["right"].astype(np.intp)
+        self.missing_go_to_left = arrays["missing_go_to_left"]
+        self.classes = arrays["classes"]
+        self.n_features = int(arrays["n_features"])
+        # Only the predicted class of every node is needed at serving time.
+        self.node_class = self.classes[arrays["value"].argmax(axis=1)]
+        self._nodes = list(zip(self.feature.tolist(), self.threshold.tolist(), self.left.tolist(),
+                               self.right.tolist(), self.missing_go_to_left.tolist()))
+
+    def apply(self, data):
+        """Index of the leaf every row ends in."""
+        data = np.asarray(data, dtype=np.float32)
+        if data.ndim != 2 or data.shape[1] != self.n_features:
+            raise ValueError(f"expected an array with {self.n_features} columns, got shape {data.shape}")
+        if len(data) <= self.SMALL_BATCH:
+            return self._apply_rows(data)
+        return self._apply_levels(data)
+
+    def _apply_rows(self, data):
+        nodes = self._nodes
+        leaves = []
+        for row in data.tolist():
+            node = 0
+            feature, threshold, left, right, missing_go_to_left = nodes[0]
+            while left >= 0:
+                value = row[feature]
+                node = left if value <= threshold or (value != value and missing_go_to_left) else right
+                feature, threshold, left, right, missing_go_to_left = nodes[node]
+            leaves.append(node)
+        return np.array(leaves, dtype=np.intp)
+
+    def _apply_levels(self, data):
+        # Row-major flat view, every step gathers one value per remaining row.
+        values_flat = data.ravel()
+        has_nan = bool(np.isnan(values_flat).any())
+        leaves = np.zeros(len(data), dtype=np.intp)
+        rows = np.arange(len(data))
+        current = np.zeros(len(data), dtype=np.intp)
+        if self.left[0] < 0:
+            return leaves
+
+        while rows.size:
+            values = values_flat.take(rows * self.n_features + self.feature.take(current))
+            go_left = values <= self.threshold.take(current)
+            if has_nan:
+                go_left |= np.isnan(values) & self.missing_go_to_left.take(current)
+            current = np.where(go_left, self.left.take(current), self.right.take(current))
+            inner = self.left.take(current) >= 0
+            if not inner.all():
+                leaves[rows[~inner]] = current[~inner]
+                rows, current = rows[inner], current[inner]
+        return leaves
+
+    def predict(self, data):
+        return self.node_class[self.apply(data)]
+
+
+def load(path):
+    with np.load(path) as arrays:
+        return FlatTree(arrays)
@@ -16,27 +16,60 @@
 # limitations under the License.
 
 
-from fastapi import Request, FastAPI
+from fastapi import Request, FastAPI, HTTPException
 import json
 import os
-from joblib import load
 import sys
-import pandas as pd
+import numpy as np
 from google.cloud import storage
-from tempfile import TemporaryFile
-import os
+import batcher
 import config
+import flat_tree
+import model_store
 
 app = FastAPI()
 
-model_directory = f"{os.environ['AIP_STORAGE_URI']}/model_dir"
-storage_path = os.path.join(model_directory, "model.joblib")
-
-storage_client = storage.Client(project=config.PROJECT_ID)
-blob = storage.blob.Blob.from_string(storage_path, client=storage_client)
+# "npz" serves the flat tree exported by the trainer without importing scikit-learn, "joblib" the pickled model.
+model_format = os.environ.get('MODEL_FORMAT', config.MODEL_FORMAT)
+loader = flat_tree.load if model_format == "npz" else model_store.load_joblib
 
-blob.download_to_filename("model.joblib")
-model =load(open("model.joblib",'rb'))
+# The model is loaded in the background, the server answers right away and /predict returns 503 until it is ready.
+if os.environ.get('MODEL_PATH') is not None:
+    # Local artifact, e.g. for benchmarks, no GCS access needed.
+    store = model_store.ModelStore(model_path=os.environ['MODEL_PATH'],
+                                   poll_interval=float(os.environ.get('MODEL_POLL_INTERVAL', 0)), loader=loader)
+else:
+    model_directory = f"{os.environ['AIP_STORAGE_URI']}/model_dir"
+    # Model directories written before the trainer exported model.npz only hold model.joblib.
+    fallback_path = os.path.join(model_directory, "model.joblib") if model_format == "npz" else None
+    store = model_store.ModelStore(storage_path=os.path.join(model_directory, f"model.{model_format}"),
+                                   cache_dir=os.environ.get('MODEL_CACHE_DIR', config.MODEL_CACHE_DIR),
+                                   poll_interval=float(os.environ.get('MODEL_POLL_INTERVAL', config.MODEL_POLL_INTERVAL)),
+                                   storage_client=storage.Client(project=config.PROJECT_ID), loader=loader,
+                                   fallback_path=fallback_path)
+store.start()
+
+
+def serving_model():
+    """The model version to answer a request with, a swap during the request does not affect it."""
+    loaded = store.current
+    if loaded is None:
+        raise HTTPException(status_code=503, detail=f"model is not loaded yet{': ' + store.error if store.error else ''}")
+    return loaded.model
+
+
+def predict_batch(instances):
+    return serving_model().predict(instances)
+
+# Optional, collects the instances of concurrent /predict requests into one predict call.
+if os.environ.get('BATCHING', str(config.BATCHING)).lower() in ('1', 'true'):
+    dynamic_batcher = batcher.DynamicBatcher(
+        predict_batch,
+        max_batch_size=int(os.environ.get('MAX_BATCH_SIZE', config.MAX_BATCH_SIZE)),
+        max_wait=float(os.environ.get('MAX_BATCH_WAIT_MS', config.MAX_BATCH_WAIT_MS)) / 1000,
+        max_queue=int(os.environ.get('MAX_QUEUE', config.MAX_QUEUE)))
+else:
+    dynamic_batcher = None
 
 @app.get('/')
 def get_root():
@@ -44,16 +77,86 @@ def get_root():
 
 @app.get('/health_check')
 def health():
-    return 200
+    # Vertex AI only routes traffic to the container once this succeeds.
+    loaded = store.current
+    if loaded is None:
+        raise HTTPException(status_code=503, detail="model is not loaded yet")
+    return {"model_version": loaded.version}
 
 if os.environ.get('AIP_PREDICT_ROUTE') is not None:
     method = os.environ['AIP_PREDICT_ROUTE']
 else:
     method = '/predict'
 
+# Column order the model was trained with, see trainer/preprocess.py.
+FEATURES = ("tax", "shipping", "value")
+
+
+def instances_to_array(instances):
+    """Converts instances into a C-contiguous float64 array with one column per feature.
+
+    Instances are either objects with the keys in FEATURES or lists already in that order.
+    """
+    if not isinstance(instances, list) or not instances:
+        raise ValueError("'instances' must be a non-empty list")
+
+    n_features = len(FEATURES)
+    if isinstance(instances[0], dict):
+        try:
+            values = [instance[feature] for instance in instances for feature in FEATURES]
+        except (KeyError, TypeError) as e:
+            raise ValueError(f"every instance needs the features {list(FEATURES)}, missing {e}")
+    else:
+        if any(len(instance) != n_features for instance in instances):
+            raise ValueError(f"every instance needs {n_features} values in the order {list(FEATURES)}")
+        values = [value for instance in instances for value in instance]
+
+    # One flat buffer reshaped in place, no intermediate per-row arrays or DataFrame.
+    try:
+        data = np.fromiter(values, dtype=np.float64, count=len(values))
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"feature values must be numbers: {e}")
+    return data.reshape(-1, n_features)
+
+
 @app.post(method)
 async def predict(request: Request):
+    body = await request.json()
+    # prepare data
+    try:
+        instances = instances_to_array(body["instances"])
+    except (KeyError, TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # retrieving predictions
+    if dynamic_batcher is None:
+        outputs = predict_batch(instances)
+    else:
+        serving_model()
+        try:
+            outputs = await dynamic_batcher.predict(instances)
+        except batcher.QueueFullError as e:
+            raise HTTPException(status_code=503, detail=str(e))
+
+    return {"predictions": outputs.tolist()}
+
+
+@app.get('/metrics')
+def metrics():
+    loaded = store.current
+    return {
+        "model_version": loaded.version if loaded else None,
+        "batching": dynamic_batcher.metrics() if dynamic_batcher else None,
+    }
+
+
+@app.post(method + "_dataframe")
+async def predict_dataframe(request: Request):
+    # Previous DataFrame based path, kept to benchmark it against the NumPy one.
+    # pandas is only imported here, the server does not need it otherwise.
+    import pandas as pd
     print("----------------- PREDICTING -----------------")
+    model = serving_model()
     body = await request.json()
     # prepare data
     instances = pd.DataFrame(body["instances"])
@@ -63,4 +166,4 @@ async def predict(request: Request):
     
     response = outputs.tolist()
     print("----------------- OUTPUTS -----------------")
-    return {"predictions": response}
\ No newline at end of file
+    return {"predictions": response}
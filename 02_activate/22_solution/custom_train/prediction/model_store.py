@@ -0,0 +1,158 @@
+# Copyright 2023 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import base64
+import hashlib
+import os
+import sys
+import threading
+import time
+from collections import namedtuple
+
+from google.cloud import storage
+from joblib import load
+
+# The model together with the artifact version it was loaded from, swapped as one reference.
+LoadedModel = namedtuple("LoadedModel", ["model", "version", "loaded_at"])
+
+
+def load_joblib(path):
+    with open(path, "rb") as f:
+        return load(f)
+
+
+def file_md5(path):
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.digest()
+
+
+class ModelStore:
+    """Loads the model in a background thread and swaps to new versions while serving.
+
+    `current` is None until the first version is loaded. Requests read it once
+    and predict with that LoadedModel, a swap only replaces the reference, so
+    requests in flight finish on the version they started with.
+
+    The artifact is either a local file (`model_path`) or the GCS object
+    `storage_path`. GCS versions are the object generations: every generation is
+    downloaded once into `cache_dir`, checked against the MD5 hash GCS reports
+    and kept there across restarts. The source is checked again every
+    `poll_interval` seconds, 0 loads it once. `loader` turns the artifact file
+    into an object with a predict method. While `storage_path` does not exist
+    the GCS object `fallback_path` is served with `fallback_loader` instead.
+
+    LocalModel in inf_processing_service_custom/local_model.py polls, verifies
+    and retries the same way for the embedded scoring mode, change both together.
+    """
+
+    # Seconds between attempts while no version could be loaded yet.
+    RETRY_INTERVAL = 5
+
+    def __init__(self, storage_path=None, model_path=None, cache_dir=None, poll_interval=0, storage_client=None,
+                 loader=load_joblib, fallback_path=None, fallback_loader=load_joblib):
+        self.storage_path = storage_path
+        self.fallback_path = fallback_path
+        self.fallback_loader = fallback_loader
+        self.model_path = model_path
+        self.cache_dir = cache_dir
+        self.poll_interval = poll_interval
+        self.storage_client = storage_client
+        self.loader = loader
+        self.current = None
+        self.error = None
+        self._ready = threading.Event()
+        self._thread = None
+
+    @property
+    def ready(self):
+        return self.current is not None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="model-store", daemon=True)
+        self._thread.start()
+        return self
+
+    def wait(self, timeout=None):
+        """Blocks until the first version is loaded, returns whether it was."""
+        return self._ready.wait(timeout)
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+                self.error = None
+            except Exception as e:
+                # Keeps serving the current version, or stays not ready, until the next check succeeds.
+                self.error = str(e)
+                print(f"[ERROR] ------ Loading the model failed: {e}", file=sys.stderr)
+            if not self.ready:
+                time.sleep(self.RETRY_INTERVAL)
+            elif self.poll_interval > 0:
+                time.sleep(self.poll_interval)
+            else:
+                return
+
+    def refresh(self):
+        """Loads the artifact if its version differs from the served one."""
+        if self.model_path is not None:
+            stat = os.stat(self.model_path)
+            version = f"{stat.st_mtime_ns}-{stat.st_size}"
+            if self.current is None or self.current.version != version:
+                self._swap(self.model_path, version, self.loader)
+            return
+
+        storage_path, loader = self.storage_path, self.loader
+        blob = storage.blob.Blob.from_string(storage_path, client=self.storage_client)
+        if self.fallback_path is not None and not blob.exists():
+            storage_path, loader = self.fallback_path, self.fallback_loader
+            blob = storage.blob.Blob.from_string(storage_path, client=self.storage_client)
+        blob.reload()
+        version = str(blob.generation)
+        if self.current is not None and self.current.version == version:
+            return
+
+        expected = base64.b64decode(blob.md5_hash)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        extension = os.path.splitext(storage_path)[1]
+        path = os.path.join(self.cache_dir, f"model-{version}{extension}")
+        if os.path.exists(path) and file_md5(path) == expected:
+            print(f"[INFO] ------ Using cached model generation {version}", file=sys.stderr)
+        else:
+            # Pinned to the generation checked above, even if a newer one is published meanwhile.
+            blob = storage.Blob(blob.name, blob.bucket, generation=blob.generation)
+            blob.download_to_filename(path + ".tmp")
+            if file_md5(path + ".tmp") != expected:
+                os.remove(path + ".tmp")
+                raise ValueError(f"MD5 of {storage_path} generation {version} does not match")
+            os.replace(path + ".tmp", path)
+        self._swap(path, version, loader)
+        self._remove_cached(keep=path)
+
+    def _swap(self, path, version, loader):
+        start = time.perf_counter()
+        model = loader(path)
+        previous = self.current
+        self.current = LoadedModel(model, version, time.time())
+        self._ready.set()
+        print(f"[INFO] ------ Serving model version {version} (loaded in {time.perf_counter() - start:.2f}s"
+              f"{', replacing ' + previous.version if previous else ''})", file=sys.stderr)
+
+    def _remove_cached(self, keep):
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.startswith("model-") and not name.endswith(".tmp") and path != keep:
+                os.remove(path)
@@ -16,5 +16,19 @@
 PROJECT_ID="<project-id>"
 REGION="europe-west1"
 AIP_STORAGE_URI=f'gs://{PROJECT_ID}-ai-bucket/vtx-artifacts'
-# training data:
-DATA_URI=f"{PROJECT_ID}.ecommerce_sink.anomaly_data"
\ No newline at end of file
+# training data, a BigQuery table or a local .parquet/.arrow file:
+DATA_URI=f"{PROJECT_ID}.ecommerce_sink.anomaly_data"
+# Columns of the training data, FEATURES in the order the model sees them.
+FEATURES=["tax", "shipping", "value"]
+LABEL="anomaly"
+# Parallel BigQuery Storage Read API streams when downloading the training data.
+READ_STREAMS=8
+# dtype of the feature matrix handed to training, float32 is what scikit-learn trees use internally.
+DTYPE="float32"
+# Directory to memory-map the training arrays from, None keeps them in memory.
+ARRAY_CACHE_DIR=None
+# Directory to keep a local copy of the training table in between runs, None downloads it every time.
+DATA_CACHE_DIR=None
+# Column whose values only grow for new rows, e.g. an ingestion timestamp. With it only newer rows are fetched
+# into DATA_CACHE_DIR, without it (anomaly_data has no such column) the table is fetched again when it was modified.
+WATERMARK_COLUMN=None
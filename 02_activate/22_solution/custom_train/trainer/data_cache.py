@@ -0,0 +1,123 @@
+# Copyright 2023 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+import json
+import os
+import re
+import sys
+
+import pyarrow as pa
+import pyarrow.compute
+import pyarrow.parquet
+
+
+def sql_literal(value):
+    """`value` as a BigQuery SQL literal, for the row restriction of the next refresh."""
+    if isinstance(value, datetime.datetime):
+        kind = "DATETIME" if value.tzinfo is None else "TIMESTAMP"
+        return f"{kind} '{value.isoformat()}'"
+    if isinstance(value, datetime.date):
+        return f"DATE '{value.isoformat()}'"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return "'" + str(value).replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+
+class TrainingDataCache:
+    """Parquet copy of a training table on local disk that is refreshed incrementally.
+
+    With a `watermark_column` (e.g. an ingestion timestamp) every refresh only
+    downloads rows whose watermark is above the largest one cached and appends
+    them as a new part file. Rows arriving later with a watermark at or below it
+    are not picked up. Without one, the whole table is downloaded again whenever
+    its last modification time differs from the cached copy.
+
+    `download_fn(columns, row_restriction)` returns the rows as Arrow and
+    `table_fn()` the BigQuery table metadata.
+    """
+
+    def __init__(self, cache_dir, table_uri, columns, watermark_column=None):
+        self.directory = os.path.join(cache_dir, re.sub(r"[^A-Za-z0-9_.-]", "_", table_uri))
+        self.table_uri = table_uri
+        self.columns = list(columns)
+        self.watermark_column = watermark_column
+        if watermark_column and watermark_column not in self.columns:
+            self.columns.append(watermark_column)
+
+    def load(self, download_fn, table_fn):
+        os.makedirs(self.directory, exist_ok=True)
+        metadata = self._read_metadata()
+
+        if self.watermark_column:
+            restriction = None
+            if metadata["watermark"] is not None:
+                restriction = f"{self.watermark_column} > {metadata['watermark']}"
+            new_rows = download_fn(self.columns, restriction)
+            if new_rows.num_rows:
+                watermark = pyarrow.compute.max(new_rows.column(self.watermark_column)).as_py()
+                metadata["watermark"] = sql_literal(watermark)
+                metadata["parts"].append(self._write_part(new_rows, len(metadata["parts"])))
+                metadata["rows"] += new_rows.num_rows
+            print(f'[INFO] ------ Fetched {new_rows.num_rows} new rows of {self.table_uri}, '
+                  f'{metadata["rows"]} cached up to {metadata["watermark"]}', file=sys.stderr)
+        else:
+            modified = table_fn().modified.isoformat()
+            if modified != metadata["modified"]:
+                rows = download_fn(self.columns, None)
+                metadata = {"modified": modified, "watermark": None, "rows": rows.num_rows,
+                            "parts": [self._write_part(rows, 0)]}
+                print(f'[INFO] ------ Downloaded {rows.num_rows} rows of {self.table_uri}, modified {modified}',
+                      file=sys.stderr)
+            else:
+                print(f'[INFO] ------ Using {metadata["rows"]} cached rows of {self.table_uri}, unchanged since {modified}',
+                      file=sys.stderr)
+
+        self._write_metadata(metadata)
+        self._remove_unlisted(metadata["parts"])
+        return pa.concat_tables(
+            pyarrow.parquet.read_table(os.path.join(self.directory, part), columns=self.columns)
+            for part in metadata["parts"])
+
+    def _read_metadata(self):
+        path = os.path.join(self.directory, "metadata.json")
+        empty = {"modified": None, "watermark": None, "rows": 0, "parts": []}
+        if not os.path.exists(path):
+            return empty
+        with open(path) as f:
+            metadata = json.load(f)
+        # A cache written with other columns or without the watermark cannot be extended.
+        if metadata.get("columns") != self.columns or metadata.get("watermark_column") != self.watermark_column:
+            return empty
+        return metadata
+
+    def _write_metadata(self, metadata):
+        metadata = dict(metadata, columns=self.columns, watermark_column=self.watermark_column)
+        path = os.path.join(self.directory, "metadata.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(metadata, f, indent=2)
+        os.replace(path + ".tmp", path)
+
+    def _write_part(self, table, index):
+        # Named by the new part's index, parts only count once they are listed in the metadata.
+        name = f"part-{index:05d}.parquet"
+        path = os.path.join(self.directory, name)
+        pyarrow.parquet.write_table(table, path + ".tmp")
+        os.replace(path + ".tmp", path)
+        return name
+
+    def _remove_unlisted(self, parts):
+        for name in os.listdir(self.directory):
+            if name.endswith(".parquet") and name not in parts:
+                os.remove(os.path.join(self.directory, name))
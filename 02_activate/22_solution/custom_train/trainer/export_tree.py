@@ -0,0 +1,68 @@
+# Copyright 2023 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Converts a fitted DecisionTreeClassifier into the flat arrays prediction/flat_tree.py evaluates without scikit-learn.
+
+import numpy as np
+
+
+def tree_arrays(model):
+    """The nodes of the fitted tree as parallel arrays, node 0 is the root.
+
+    Leaves have left == right == -1. `value` holds the class distribution of
+    every node and `classes` the labels its columns stand for.
+    """
+    tree = model.tree_
+    if tree.n_outputs != 1:
+        raise ValueError("only single output trees can be exported")
+    value = tree.value[:, 0, :]
+    n_nodes = tree.node_count
+    return {
+        "feature": tree.feature.astype(np.int32),
+        "threshold": tree.threshold.astype(np.float64),
+        "left": tree.children_left.astype(np.int32),
+        "right": tree.children_right.astype(np.int32),
+        "value": value / value.sum(axis=1, keepdims=True),
+        # Trees fitted on data with NaN send it to one side per node, older versions have no missing values.
+        "missing_go_to_left": getattr(tree, "missing_go_to_left", np.zeros(n_nodes, dtype=np.uint8)).astype(bool),
+        "classes": np.asarray(model.classes_),
+        "n_features": np.int32(model.n_features_in_ if hasattr(model, "n_features_in_") else model.n_features_),
+    }
+
+
+def predict_arrays(arrays, data):
+    # The traversal of prediction/flat_tree.py, repeated here because the trainer and prediction images are built
+    # from their own directories.
+    data = np.asarray(data, dtype=np.float32)
+    node = np.zeros(len(data), dtype=np.intp)
+    active = np.arange(len(data))
+    while active.size:
+        current = node[active]
+        inner = arrays["left"][current] >= 0
+        active, current = active[inner], current[inner]
+        values = data[active, arrays["feature"][current]]
+        go_left = (values <= arrays["threshold"][current]) | (np.isnan(values) & arrays["missing_go_to_left"][current])
+        node[active] = np.where(go_left, arrays["left"][current], arrays["right"][current])
+    return arrays["classes"][arrays["value"][node].argmax(axis=1)]
+
+
+def export_tree(model, path, validation_data):
+    """Writes the tree to `path` as .npz and checks it predicts `validation_data` exactly like the model."""
+    arrays = tree_arrays(model)
+    expected = model.predict(validation_data)
+    mismatches = int((predict_arrays(arrays, validation_data) != expected).sum())
+    if mismatches:
+        raise ValueError(f"exported tree differs from the model on {mismatches} of {len(expected)} validation rows")
+    np.savez(path, **arrays)
+    return arrays
@@ -28,16 +28,19 @@ import pandas as pd
 import sys
 
 # data uri
-data_uri = config.DATA_URI
+data_uri = os.environ.get("DATA_URI", config.DATA_URI)
 
-# bq client
-bqclient = bigquery.Client(project=config.PROJECT_ID)
+# bq client, not needed for local training data
+bqclient = None if preprocess.is_local(data_uri) else bigquery.Client(project=config.PROJECT_ID)
 storage_client = storage.Client(project=config.PROJECT_ID)
 
 ## Download & prep data
 print('[INFO] ------ Preparing Data', file=sys.stderr)
-train_data, train_labels, test_data, test_labels = preprocess.prep_data(bqclient, storage_client, data_uri)
+train_data, train_labels, test_data, test_labels = preprocess.prep_data(
+    bqclient, storage_client, data_uri, cache_dir=os.environ.get("ARRAY_CACHE_DIR", config.ARRAY_CACHE_DIR),
+    data_cache_dir=os.environ.get("DATA_CACHE_DIR", config.DATA_CACHE_DIR))
 
 ## Train model and save it in Google Cloud Storage
 print('[INFO] ------ Training & Saving Model', file=sys.stderr)
-train.train_model(train_data, train_labels, test_data, test_labels, storage_client)
\ No newline at end of file
+train.train_model(train_data, train_labels, test_data, test_labels, storage_client)
+preprocess.memory_report("training")
\ No newline at end of file
@@ -14,33 +14,140 @@
 
 from sklearn.tree import DecisionTreeClassifier
 from sklearn.metrics import roc_curve
-from sklearn.model_selection import train_test_split
 from google.cloud import bigquery
+from google.cloud import bigquery_storage
 from google.cloud import storage
 from joblib import dump
+from concurrent.futures import ThreadPoolExecutor
 
+import math
 import os
+import resource
+import sys
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.feather
+import pyarrow.fs
+import pyarrow.parquet
 
-def download_table(bqclient, storage_client, bq_table_uri: str):
+import config
+import data_cache
 
+# Files that are read directly instead of from BigQuery, e.g. for offline runs.
+LOCAL_FORMATS = (".parquet", ".arrow", ".feather")
+
+def is_local(data_uri: str):
+    return data_uri.endswith(LOCAL_FORMATS)
+
+def read_local_table(path: str, columns):
+    # URIs like gs:// go through the matching pyarrow filesystem, plain paths are local files.
+    filesystem = None
+    if "://" in path:
+        filesystem, path = pyarrow.fs.FileSystem.from_uri(path)
+    if path.endswith(".parquet"):
+        return pyarrow.parquet.read_table(path, columns=columns, filesystem=filesystem)
+    if filesystem is None:
+        return pyarrow.feather.read_table(path, columns=columns)
+    with filesystem.open_input_file(path) as f:
+        return pyarrow.feather.read_table(f, columns=columns)
+
+def table_reference(bq_table_uri: str):
     prefix = "bq://"
     if bq_table_uri.startswith(prefix):
         bq_table_uri = bq_table_uri[len(prefix):]
+    return bigquery.TableReference.from_string(bq_table_uri)
+
+def download_table(bqclient, storage_client, bq_table_uri: str, columns=None, row_restriction=None):
+    """Reads `columns` of the table as Arrow, by default the features and the label in training order.
+
+    BigQuery tables are read with the Storage Read API in up to config.READ_STREAMS
+    parallel streams, only rows matching the SQL `row_restriction` if one is given.
+    Parquet and Arrow files are read as a whole, from local disk or a gs:// URI.
+    """
+    columns = list(columns or config.FEATURES + [config.LABEL])
+    if is_local(bq_table_uri):
+        return read_local_table(bq_table_uri, columns).select(columns)
 
-    table = bigquery.TableReference.from_string(bq_table_uri)
-    rows = bqclient.list_rows(
-        table,
+    table = table_reference(bq_table_uri)
+    read_client = bigquery_storage.BigQueryReadClient()
+    requested_session = bigquery_storage.types.ReadSession(
+        table=f"projects/{table.project}/datasets/{table.dataset_id}/tables/{table.table_id}",
+        data_format=bigquery_storage.types.DataFormat.ARROW,
+        read_options=bigquery_storage.types.ReadSession.TableReadOptions(selected_fields=columns,
+                                                                          row_restriction=row_restriction or ""),
     )
-    return rows.to_dataframe(create_bqstorage_client=False)
+    session = read_client.create_read_session(
+        parent=f"projects/{bqclient.project}",
+        read_session=requested_session,
+        max_stream_count=config.READ_STREAMS,
+    )
+
+    if not session.streams:
+        # Empty table, BigQuery hands out no streams but still describes the columns.
+        schema = pa.ipc.read_schema(pa.py_buffer(session.arrow_schema.serialized_schema))
+        return schema.empty_table().select(columns)
+
+    def read_stream(stream):
+        return read_client.read_rows(stream.name).to_arrow(session)
+
+    with ThreadPoolExecutor(max_workers=len(session.streams)) as executor:
+        tables = list(executor.map(read_stream, session.streams))
+
+    # Streams return the columns in table order.
+    return pa.concat_tables(tables).select(columns)
+
+def memory_report(stage: str, **sizes):
+    # ru_maxrss is in KiB on Linux.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    details = "".join(f", {name} {size / 2**20:.1f} MiB" for name, size in sizes.items())
+    print(f'[INFO] ------ Memory after {stage}: peak RSS {peak:.1f} MiB{details}', file=sys.stderr)
+
+def allocate(shape, dtype, cache_dir, name):
+    """A new array, memory-mapped from `cache_dir`/`name`.npy if a cache directory is given."""
+    if cache_dir is None:
+        return np.empty(shape, dtype=dtype)
+    os.makedirs(cache_dir, exist_ok=True)
+    return np.lib.format.open_memmap(os.path.join(cache_dir, f"{name}.npy"), mode="w+", dtype=dtype, shape=shape)
+
+def load_table(bqclient, storage_client, data_uri: str, data_cache_dir=None):
+    """The features and the label, from the local copy in `data_cache_dir` if one is given."""
+    if data_cache_dir is None or is_local(data_uri):
+        return download_table(bqclient, storage_client, data_uri)
+
+    columns = config.FEATURES + [config.LABEL]
+    cache = data_cache.TrainingDataCache(data_cache_dir, data_uri, columns, config.WATERMARK_COLUMN)
+    table = cache.load(
+        lambda columns, row_restriction: download_table(bqclient, storage_client, data_uri, columns, row_restriction),
+        lambda: bqclient.get_table(table_reference(data_uri)))
+    return table.select(columns)
+
+def prep_data(bqclient, storage_client, data_uri: str, cache_dir=None, test_size=0.25, seed=None,
+              data_cache_dir=None):
+    """Downloads the data and splits it into shuffled train / test arrays.
+
+    The features are a single C-contiguous config.DTYPE matrix in FEATURES order,
+    float32 is what the decision tree trains on so scikit-learn uses it without a
+    copy. Train and test sets are views into it. With `cache_dir` the arrays are
+    memory-mapped files there, so they do not have to fit into RAM. With
+    `data_cache_dir` the table is kept there and only refreshed on later runs.
+    """
+    table = load_table(bqclient, storage_client, data_uri, data_cache_dir)
+    memory_report("download", table=table.nbytes)
+
+    rows = table.num_rows
+    order = np.random.default_rng(seed).permutation(rows)
 
-def prep_data(bqclient, storage_client, data_uri: str):
+    # Filled one column at a time, so only a single column is ever copied on top of the table.
+    data = allocate((rows, len(config.FEATURES)), config.DTYPE, cache_dir, "data")
+    for i, feature in enumerate(config.FEATURES):
+        data[:, i] = table.column(feature).to_numpy()[order]
+    labels = allocate((rows,), table.schema.field(config.LABEL).type.to_pandas_dtype(), cache_dir, "labels")
+    labels[:] = table.column(config.LABEL).to_numpy()[order]
+    del table
 
-    # Download data into Pandas DataFrames, split into train / test
-    df, test_df = train_test_split(download_table(bqclient, storage_client, data_uri))
-    labels = df.pop("anomaly").tolist()
-    data = df.values.tolist()
-    test_labels = test_df.pop("anomaly").tolist()
-    test_data = test_df.values.tolist()
+    # Same split sizes as sklearn's train_test_split.
+    split = rows - math.ceil(test_size * rows)
+    memory_report("preprocessing", data=data.nbytes, labels=labels.nbytes)
 
-    return data, labels, test_data, test_labels
\ No newline at end of file
+    return data[:split], labels[:split], data[split:], labels[split:]
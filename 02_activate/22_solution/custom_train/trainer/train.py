@@ -19,6 +19,7 @@ from google.cloud import bigquery
 from google.cloud import storage
 from joblib import dump
 
+import export_tree
 import os
 import pandas as pd
 
@@ -40,4 +41,9 @@ def train_model(data, labels, test_data, test_labels, storage_client):
     blob = storage.blob.Blob.from_string(storage_path, client=storage_client)
     blob.upload_from_filename("model.joblib")
 
+    # Flat arrays of the same tree for serving without scikit-learn, checked to predict the test set identically.
+    export_tree.export_tree(skmodel, "model.npz", test_data)
+    blob = storage.blob.Blob.from_string(os.path.join(model_directory, "model.npz"), client=storage_client)
+    blob.upload_from_filename("model.npz")
+
     return(skmodel)
\ No newline at end of file
@@ -0,0 +1,89 @@
+# Copyright 2023 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Writes the centroids and feature scaling of the KMEANS model trained by kf_pipe.py to
+# bq_model-artifacts/centroids.json, for inf_processing_service/centroid_scorer.py.
+#
+# python3 export_centroids.py [--output centroids.json]
+#
+# The exported SavedModel keeps the centroids in TensorFlow variables, reading them from BigQuery ML
+# gives the same values without a TensorFlow dependency.
+
+import argparse
+import datetime
+import json
+
+from google.cloud import bigquery
+from google.cloud import storage
+
+import config
+
+MODEL = f"{config.GCP_PROJECT}.ecommerce_sink.anomaly_detection"
+# Column order of the instances the service scores, see inf_processing_service/events.py.
+FEATURES = ["tax", "shipping", "value"]
+
+
+def read_centroids(client, model):
+    """Centroid ids and centroids in the standardized feature space the model measures distances in."""
+    query = f"""
+        SELECT centroid_id, feature, numerical_value
+        FROM ML.CENTROIDS(MODEL `{model}`, STRUCT(TRUE AS standardize))
+        ORDER BY centroid_id
+    """
+    centroids = {}
+    for row in client.query(query).result():
+        centroids.setdefault(row.centroid_id, {})[row.feature] = row.numerical_value
+    ids = sorted(centroids)
+    return ids, [[centroids[centroid_id][feature] for feature in FEATURES] for centroid_id in ids]
+
+
+def read_scaling(client, model):
+    """Mean and standard deviation of every feature in the training data, used to standardize instances."""
+    query = f"SELECT input, mean, stddev FROM ML.FEATURE_INFO(MODEL `{model}`)"
+    info = {row.input: row for row in client.query(query).result()}
+    return [info[feature].mean for feature in FEATURES], [info[feature].stddev for feature in FEATURES]
+
+
+def export_centroids(client, model):
+    centroid_ids, centroids = read_centroids(client, model)
+    mean, stddev = read_scaling(client, model)
+    return {
+        "model": model,
+        "exported_at": datetime.datetime.utcnow().isoformat(),
+        "features": FEATURES,
+        # kf_pipe.py trains with the defaults, standardized features and Euclidean distance.
+        "distance_type": "EUCLIDEAN",
+        "centroid_ids": centroid_ids,
+        "centroids": centroids,
+        "mean": mean,
+        "stddev": stddev,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default=MODEL, help="BigQuery ML KMEANS model")
+    parser.add_argument("--destination", default=f"{config.PIPELINE_ROOT_PATH}/bq_model-artifacts/centroids.json",
+                        help="GCS object to write the centroids to")
+    parser.add_argument("--output", help="Also write them to this local file")
+    args = parser.parse_args()
+
+    exported = json.dumps(export_centroids(bigquery.Client(project=config.GCP_PROJECT), args.model), indent=2)
+
+    blob = storage.blob.Blob.from_string(args.destination, client=storage.Client(project=config.GCP_PROJECT))
+    blob.upload_from_string(exported, content_type="application/json")
+    print(f"Centroids of {args.model} written to {args.destination}")
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(exported)
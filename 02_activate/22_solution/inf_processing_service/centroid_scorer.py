@@ -0,0 +1,82 @@
+# Copyright 2023 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+
+import numpy as np
+
+
+class CentroidScorer:
+    """Nearest centroid of the KMEANS model, computed in-process instead of by the Vertex AI endpoint.
+
+    Reads the centroids.json written by export_centroids.py. Instances are
+    standardized with the training mean and standard deviation before the
+    distances to the (standardized) centroids are taken, like BigQuery ML does.
+    """
+
+    def __init__(self, features, centroid_ids, centroids, mean, stddev, distance_type="EUCLIDEAN", version=None):
+        self.features = list(features)
+        # Export time of the centroids, tells cached predictions of different exports apart.
+        self.version = version
+        self.centroid_ids = np.asarray(centroid_ids)
+        self.centroids = np.asarray(centroids, dtype=np.float64)
+        self.mean = np.asarray(mean, dtype=np.float64)
+        # Constant features carry no distance information.
+        self.stddev = np.where(np.asarray(stddev, dtype=np.float64) > 0, stddev, 1.0)
+        self.distance_type = distance_type.upper()
+        if self.distance_type not in ("EUCLIDEAN", "COSINE"):
+            raise ValueError(f"unsupported distance type {distance_type}")
+        if self.distance_type == "COSINE":
+            self._unit_centroids = self.centroids / np.linalg.norm(self.centroids, axis=1, keepdims=True)
+
+    @classmethod
+    def from_json(cls, text):
+        exported = json.loads(text)
+        return cls(exported["features"], exported["centroid_ids"], exported["centroids"],
+                   exported["mean"], exported["stddev"], exported.get("distance_type", "EUCLIDEAN"),
+                   exported.get("exported_at"))
+
+    @classmethod
+    def load(cls, uri):
+        """Reads centroids.json from a local path or a gs:// URI."""
+        if uri.startswith("gs://"):
+            # Only needed for GCS, the service does not depend on it otherwise.
+            from google.cloud import storage
+            return cls.from_json(storage.blob.Blob.from_string(uri, client=storage.Client()).download_as_text())
+        with open(uri) as f:
+            return cls.from_json(f.read())
+
+    def to_array(self, instances):
+        return np.array([[instance[feature] for feature in self.features] for instance in instances],
+                        dtype=np.float64).reshape(-1, len(self.features))
+
+    def distances(self, data):
+        """Distance of every row of `data` to every centroid, shape (rows, centroids)."""
+        scaled = (data - self.mean) / self.stddev
+        if self.distance_type == "COSINE":
+            norms = np.linalg.norm(scaled, axis=1, keepdims=True)
+            return 1.0 - (scaled / np.where(norms > 0, norms, 1.0)) @ self._unit_centroids.T
+        differences = scaled[:, np.newaxis, :] - self.centroids[np.newaxis, :, :]
+        return np.sqrt(np.einsum("ijk,ijk->ij", differences, differences))
+
+    def nearest(self, data):
+        return self.centroid_ids[self.distances(data).argmin(axis=1)]
+
+    def predict(self, instances):
+        """Predictions shaped like the ones of the deployed endpoint, one per instance."""
+        distances = self.distances(self.to_array(instances))
+        nearest = self.centroid_ids[distances.argmin(axis=1)].tolist()
+        centroid_ids = self.centroid_ids.tolist()
+        return [{"nearest_centroid_id": [centroid_id], "centroid_id": centroid_ids, "centroid_distance": row}
+                for centroid_id, row in zip(nearest, distances.tolist())]
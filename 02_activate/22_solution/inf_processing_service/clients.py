@@ -0,0 +1,166 @@
+# Copyright 2023 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import threading
+import time
+
+from contextlib import contextmanager
+
+import config
+
+from google.cloud import bigquery, aiplatform
+
+
+class ClientPool:
+    """Process-wide pool of long-lived API clients shared by all request threads.
+
+    Clients are created lazily from `factories` (name -> callable) on first use,
+    or up front with `warm_up()`. A client that fails `max_failures` times in a
+    row is dropped and transparently recreated on the next `get()`, so a broken
+    channel does not poison the worker for the rest of its life.
+    """
+
+    def __init__(self, factories, max_failures=3):
+        self.factories = factories
+        self.max_failures = max_failures
+
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._failures = {}
+        self._pid = os.getpid()
+
+    def get(self, name):
+        client = self._clients.get(name)
+        if client is not None and self._pid == os.getpid():
+            return client
+
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked into a new worker, channels of the parent must not be reused.
+                self._clients.clear()
+                self._failures.clear()
+                self._pid = os.getpid()
+
+            client = self._clients.get(name)
+            if client is None:
+                start = time.time()
+                client = self.factories[name]()
+                self._clients[name] = client
+                self._failures[name] = 0
+                print(f"{time.time()} Created {name} client in {time.time() - start:.3f}s.")
+        return client
+
+    @contextmanager
+    def use(self, name):
+        """Yield the named client and record whether the calls made with it succeeded."""
+        client = self.get(name)
+        try:
+            yield client
+        except Exception:
+            self.report_failure(name, client)
+            raise
+        else:
+            self.report_success(name)
+
+    def report_success(self, name):
+        self._failures[name] = 0
+
+    def report_failure(self, name, client):
+        with self._lock:
+            if self._clients.get(name) is not client:
+                # Already recycled by another thread.
+                return
+            self._failures[name] = self._failures.get(name, 0) + 1
+            if self._failures[name] < self.max_failures:
+                return
+            print(f"{time.time()} Recycling {name} client after {self._failures[name]} consecutive failures.")
+            del self._clients[name]
+            self._failures[name] = 0
+
+        close = getattr(client, "close", None)
+        if close is not None:
+            try:
+                close()
+            except Exception as e:
+                print(f"Closing {name} client failed: {e}")
+
+    def warm_up(self):
+        """Create all clients now instead of on the first request."""
+        for name in self.factories:
+            try:
+                self.get(name)
+            except Exception as e:
+                # Not fatal, the client is retried lazily on the first request that needs it.
+                print(f"Warm-up of {name} client failed: {e}")
+
+
+def bigquery_client():
+    return bigquery.Client(project=config.project_id, location=config.location)
+
+
+def prediction_endpoint():
+    aiplatform.init(project=config.project_id, location=config.location)
+
+    # Resolves the endpoint resource once, later predict calls only pay for the RPC itself.
+    return aiplatform.Endpoint(
+        endpoint_name=f"projects/{config.project_id}/locations/{config.location}/endpoints/{config.endpoind_id}",
+        project=config.project_id,
+        location=config.location,
+    )
+
+
+def create_pool():
+    return ClientPool({"bigquery": bigquery_client, "endpoint": prediction_endpoint},
+                      max_failures=config.client_max_failures)
+
+
+class DeployedModels:
+    """Ids of the models deployed to the endpoint, listed every `interval` seconds in a background thread.
+
+    Tells up front which cached predictions the endpoint could still make: after
+    a redeploy the old model's id drops out, under a traffic split all deployed
+    ids are in. `get()` only reads the latest listing, no request waits for the
+    listing call. None until the first listing succeeded.
+    """
+
+    def __init__(self, pool, interval=30):
+        self.pool = pool
+        self.interval = interval
+
+        self._ids = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    # Started by the first purchase, so the listing runs in the worker that scores purchases.
+                    self._thread = threading.Thread(target=self._run, name="deployed-models", daemon=True)
+                    self._thread.start()
+        return self._ids
+
+    def _run(self):
+        while True:
+            self.refresh()
+            time.sleep(self.interval)
+
+    def refresh(self):
+        try:
+            with self.pool.use("endpoint") as endpoint:
+                self._ids = frozenset(model.id for model in endpoint.list_models())
+        except Exception as e:
+            # The previous ids stay in use until the next listing succeeds.
+            print(f"Listing the deployed models failed: {e}")
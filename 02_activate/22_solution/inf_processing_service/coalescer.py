@@ -0,0 +1,110 @@
+# Copyright 2023 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class PredictionCoalescer:
+    """Merges the instances of concurrent requests into multi-instance predict calls.
+
+    `predict_fn(instances)` must return one prediction per instance, in order.
+    An instance waits at most `max_wait` seconds for others to join its call,
+    a call never carries more than `max_batch` instances and at most
+    `max_in_flight` calls run at the same time. While all of them are in flight
+    no new call is cut, the queued instances go out together in the next one.
+    """
+
+    def __init__(self, predict_fn, max_batch=64, max_wait=0.005, max_in_flight=4):
+        self.predict_fn = predict_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.max_in_flight = max_in_flight
+
+        self.calls = 0
+        self.instances = 0
+
+        self._lock = threading.Condition()
+        self._pending = []
+        self._thread = None
+        self._executor = None
+        # One slot per call that may be in flight, taken before a batch is cut.
+        self._slots = threading.Semaphore(max_in_flight)
+
+    def submit(self, instance):
+        """Queue one instance and return a Future for its prediction."""
+        future = Future()
+
+        with self._lock:
+            if self._thread is None:
+                # Nothing is started at import, the first purchase creates the thread and the call pool.
+                self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="predict")
+                self._thread = threading.Thread(target=self._run, name="predict-coalescer", daemon=True)
+                self._thread.start()
+
+            self._pending.append((instance, future, time.monotonic()))
+            # The coalescer thread only has a deadline once an instance is queued, so the first one
+            # wakes it up to start the max_wait timer. A full batch does not wait for the timer.
+            if len(self._pending) == 1 or len(self._pending) >= self.max_batch:
+                self._lock.notify()
+
+        return future
+
+    def predict(self, instance, timeout=None):
+        """Queue one instance and block until its prediction is back."""
+        return self.submit(instance).result(timeout=timeout)
+
+    def _run(self):
+        while True:
+            # Queued instances keep piling up while every call is in flight, so the next batch is larger.
+            self._slots.acquire()
+            with self._lock:
+                while True:
+                    if self._pending:
+                        if len(self._pending) >= self.max_batch:
+                            break
+                        remaining = self._pending[0][2] + self.max_wait - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._lock.wait(remaining)
+                    else:
+                        self._lock.wait()
+                batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+
+            self._executor.submit(self._predict, batch)
+
+    def _predict(self, batch):
+        instances = [entry[0] for entry in batch]
+        futures = [entry[1] for entry in batch]
+
+        try:
+            predictions = self.predict_fn(instances)  # Make an API request.
+            if len(predictions) != len(instances):
+                raise ValueError(f"Got {len(predictions)} predictions for {len(instances)} instances")
+        except Exception as e:
+            print(f"Prediction of {len(instances)} instances failed: {e}")
+            for future in futures:
+                future.set_exception(e)
+            return
+        finally:
+            self._slots.release()
+
+        with self._lock:
+            self.calls += 1
+            self.instances += len(instances)
+
+        for future, prediction in zip(futures, predictions):
+            future.set_result(prediction)
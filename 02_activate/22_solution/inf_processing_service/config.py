@@ -18,3 +18,25 @@ bq_dataset = 'ecommerce_sink'
 bq_table = 'cloud_run'
 bq_table_anomaly = 'cloud_run_anomaly'
 endpoind_id = '<endpoint-id>'
+
+# Consecutive failed calls after which a pooled client is recreated.
+client_max_failures = 3
+
+# Threads running blocking client calls in main_asgi.py.
+asgi_max_workers = 32
+
+# Coalescing of concurrent purchases into multi-instance predict calls.
+predict_max_batch = 64
+predict_max_wait = 0.005  # seconds
+predict_max_in_flight = 4
+
+# Anomaly scoring of purchases: 'endpoint' calls the deployed Vertex AI endpoint,
+# 'local' takes the nearest centroid in-process from the file written by export_centroids.py.
+scoring_mode = 'endpoint'
+centroids_uri = f'gs://{project_id}-ecommerce-events/bq_model-artifacts/centroids.json'
+
+# Predictions cached per (tax, shipping, value) and model version, 0 entries disables the cache.
+prediction_cache_size = 10000
+prediction_cache_ttl = 300  # seconds
+# Seconds between listings of the endpoint's deployed models, cached predictions of other models are not used.
+deployed_models_poll_interval = 30
@@ -14,18 +14,58 @@
 
 import os
 import time
-import base64
-import json
-import datetime
 import config
+import events
 
 from flask import Flask, request
 
-from google.cloud import bigquery, aiplatform
+import clients
+from centroid_scorer import CentroidScorer
+from coalescer import PredictionCoalescer
+from prediction_cache import PredictionCache
 
 
 app = Flask(__name__)
 
+# Clients are created once per worker and shared by all request threads.
+pool = clients.create_pool()
+pool.warm_up()
+
+
+def predict(instances):
+    with pool.use("endpoint") as endpoint:
+        response = endpoint.predict(instances=instances)
+        # Tagged with the deployed model that made them, cached predictions are keyed on it.
+        return [(response.deployed_model_id, prediction) for prediction in response.predictions]
+
+
+# Purchases of concurrent pushes share one multi-instance predict call.
+coalescer = PredictionCoalescer(predict,
+                                max_batch=config.predict_max_batch,
+                                max_wait=config.predict_max_wait,
+                                max_in_flight=config.predict_max_in_flight)
+
+# With local scoring the endpoint is not called, purchases are scored on the request thread in microseconds.
+scorer = CentroidScorer.load(config.centroids_uri) if config.scoring_mode == 'local' else None
+
+# Purchases repeat the same features often, their predictions are reused until the model changes.
+cache = PredictionCache(max_entries=config.prediction_cache_size, ttl=config.prediction_cache_ttl)
+deployed_models = None if scorer else clients.DeployedModels(pool, config.deployed_models_poll_interval)
+
+
+def score(features):
+    prediction = cache.get(features, (scorer.version,) if scorer else deployed_models.get())
+    if prediction is None:
+        if scorer:
+            version, prediction = scorer.version, scorer.predict([features])[0]
+        else:
+            version, prediction = coalescer.predict(features)
+        cache.put(version, features, prediction)
+    return prediction
+
+table_id = config.project_id + '.' + config.bq_dataset + '.' + config.bq_table
+table_id_anomaly = config.project_id + '.' + config.bq_dataset + '.' + config.bq_table_anomaly
+
 
 @app.route("/hw", methods=['GET', 'POST'])
 def hello_world():
@@ -33,6 +73,11 @@ def hello_world():
     return f"Hello {world}!"
 
 
+@app.route("/cache_stats", methods=["GET"])
+def cache_stats():
+    return cache.stats()
+
+
 @app.route("/", methods=["POST"])
 def index():
     envelope = request.get_json()
@@ -44,65 +89,37 @@ def index():
         print(f"error: {msg}")
         return f"Bad Request: {msg}", 400
 
-    ps_message = envelope['message']
-
-    record = base64.b64decode(ps_message["data"]).decode("utf-8").strip()
-    record = json.loads(record)
-
-    record["weekday"] = datetime.datetime.strptime(record["event_datetime"], "%Y-%m-%d %H:%M:%S").strftime('%A')
+    record = events.decode_message(envelope)
 
     rows_to_insert = [record]
 
-    client = bigquery.Client(project=config.project_id, location=config.location)
-    table_id = config.project_id + '.' + config.bq_dataset + '.' + config.bq_table
-
-    errors = client.insert_rows_json(table_id, rows_to_insert)  # Make an API request.
+    with pool.use("bigquery") as client:
+        errors = client.insert_rows_json(table_id, rows_to_insert)  # Make an API request.
 
 
     # Create record that includes anomaly detection inference.
     if record["event"] == "purchase":
-        record_to_predict = [
-            {"tax": record["ecommerce"]["purchase"]["tax"],
-            "shipping": record["ecommerce"]["purchase"]["shipping"],
-            "value":record["ecommerce"]["purchase"]["value"]}
-            ]
+        features = events.purchase_features(record)
 
-        aiplatform.init(project=config.project_id, location=config.location)
+        prediction = score(features)
 
-        endpoint = aiplatform.Endpoint(
-            endpoint_name=f"projects/{config.project_id}/locations/{config.location}/endpoints/{config.endpoind_id}",
-            project = config.project_id,
-            location=config.location,
-            )
-
-        endpoint_response = endpoint.predict(
-            instances=record_to_predict
-        )
-
-        centroid = endpoint_response.predictions[0]["nearest_centroid_id"][0]
-
-        if centroid == 1:
-            anomaly = True
-        if centroid == 2:
-            anomaly = False
+        anomaly = events.is_anomaly(prediction)
 
         print(anomaly)
-        
-        anomaly_record = {"tax": record["ecommerce"]["purchase"]["tax"], "shipping": record["ecommerce"]["purchase"]["shipping"], "value":record["ecommerce"]["purchase"]["value"], "anomaly": anomaly}
 
-        rows_to_insert = [anomaly_record]
+        anomaly_record = dict(features, anomaly=anomaly)
 
-        client = bigquery.Client(project=config.project_id, location=config.location)
-        table_id = config.project_id + '.' + config.bq_dataset + '.' + config.bq_table_anomaly
+        rows_to_insert = [anomaly_record]
 
-        errors_an = client.insert_rows_json(table_id, rows_to_insert)  # Make an API request.
+        with pool.use("bigquery") as client:
+            errors_an = client.insert_rows_json(table_id_anomaly, rows_to_insert)  # Make an API request.
 
 
         if errors_an == []:
             print(f"{time.time()} New rows with prediction have been added.")
             return ("", 204)
         else:
-            print("Encountered errors while inserting rows: {}".format(errors))
+            print("Encountered errors while inserting rows: {}".format(errors_an))
             return f"Bad Request: {envelope}", 400
 
     if errors == []:
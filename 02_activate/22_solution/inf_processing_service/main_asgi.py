@@ -0,0 +1,145 @@
+# Copyright 2023 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# ASGI variant of main.py with the same routes and responses.
+# The raw event insert and the prediction run concurrently, the anomaly insert starts as soon as the prediction is back.
+# Run with: uvicorn main_asgi:app --host 0.0.0.0 --port $PORT
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import config
+import events
+
+from fastapi import FastAPI, Request
+from fastapi.responses import HTMLResponse, Response
+
+import clients
+from centroid_scorer import CentroidScorer
+from coalescer import PredictionCoalescer
+from prediction_cache import PredictionCache
+
+
+app = FastAPI()
+
+pool = clients.create_pool()
+
+table_id = config.project_id + '.' + config.bq_dataset + '.' + config.bq_table
+table_id_anomaly = config.project_id + '.' + config.bq_dataset + '.' + config.bq_table_anomaly
+
+# The Google client libraries are blocking, their calls are run on this executor.
+executor = ThreadPoolExecutor(max_workers=config.asgi_max_workers, thread_name_prefix="gcp-client")
+
+
+def insert_rows(table, rows):
+    with pool.use("bigquery") as client:
+        return client.insert_rows_json(table, rows)  # Make an API request.
+
+
+def predict(instances):
+    with pool.use("endpoint") as endpoint:
+        response = endpoint.predict(instances=instances)
+        # Tagged with the deployed model that made them, cached predictions are keyed on it.
+        return [(response.deployed_model_id, prediction) for prediction in response.predictions]
+
+
+# Purchases of concurrent pushes share one multi-instance predict call.
+coalescer = PredictionCoalescer(predict,
+                                max_batch=config.predict_max_batch,
+                                max_wait=config.predict_max_wait,
+                                max_in_flight=config.predict_max_in_flight)
+
+# With local scoring the endpoint is not called, purchases are scored on the request thread in microseconds.
+scorer = CentroidScorer.load(config.centroids_uri) if config.scoring_mode == 'local' else None
+
+# Purchases repeat the same features often, their predictions are reused until the model changes.
+cache = PredictionCache(max_entries=config.prediction_cache_size, ttl=config.prediction_cache_ttl)
+deployed_models = None if scorer else clients.DeployedModels(pool, config.deployed_models_poll_interval)
+
+
+async def score(features):
+    prediction = cache.get(features, (scorer.version,) if scorer else deployed_models.get())
+    if prediction is None:
+        if scorer:
+            version, prediction = scorer.version, scorer.predict([features])[0]
+        else:
+            version, prediction = await asyncio.wrap_future(coalescer.submit(features))
+        cache.put(version, features, prediction)
+    return prediction
+
+
+async def run_blocking(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
+
+@app.on_event("startup")
+async def warm_up():
+    await run_blocking(pool.warm_up)
+
+
+@app.api_route("/hw", methods=["GET", "POST"], response_class=HTMLResponse)
+async def hello_world(world: Optional[str] = None):
+    return f"Hello {world}!"
+
+
+@app.get("/cache_stats")
+async def cache_stats():
+    return cache.stats()
+
+
+@app.post("/")
+async def index(request: Request):
+    try:
+        envelope = await request.json()
+    except ValueError:
+        envelope = None
+
+    if not envelope:
+        msg = "no Pub/Sub message received"
+        print(f"error: {msg}")
+        return HTMLResponse(f"Bad Request: {msg}", status_code=400)
+
+    record = events.decode_message(envelope)
+
+    raw_insert = asyncio.ensure_future(run_blocking(insert_rows, table_id, [record]))
+
+    if record["event"] == "purchase":
+        features = events.purchase_features(record)
+
+        try:
+            prediction = await score(features)
+            anomaly = events.is_anomaly(prediction)
+
+            anomaly_record = dict(features, anomaly=anomaly)
+            errors_an = await run_blocking(insert_rows, table_id_anomaly, [anomaly_record])
+        finally:
+            # The raw row is written either way, do not leave the request before it is.
+            errors = await raw_insert
+
+        if errors_an == []:
+            print(f"{time.time()} New rows with prediction have been added.")
+            return Response(status_code=204)
+        else:
+            print("Encountered errors while inserting rows: {}".format(errors_an))
+            return HTMLResponse(f"Bad Request: {envelope}", status_code=400)
+
+    errors = await raw_insert
+    if errors == []:
+        print(f"{time.time()} New rows have been added.")
+        return Response(status_code=204)
+    else:
+        print("Encountered errors while inserting rows: {}".format(errors))
+        return HTMLResponse(f"Bad Request: {envelope}", status_code=400)
@@ -18,3 +18,18 @@ bq_dataset = 'ecommerce_sink'
 bq_table = 'cloud_run'
 bq_table_anomaly = 'cloud_run_anomaly_custom'
 endpoind_id = '<endpoint-id>'
+
+# Consecutive failed calls after which a pooled client is recreated.
+client_max_failures = 3
+
+# 'embedded' scores purchases with model.joblib inside the service, 'remote' calls the Vertex endpoint.
+# Embedded mode falls back to the endpoint as long as no model could be loaded from model_uri.
+scoring_mode = 'embedded'
+model_uri = f'gs://{project_id}-ai-bucket/vtx-artifacts/model_dir/model.joblib'
+model_poll_interval = 60  # seconds
+
+# Predictions cached per (tax, shipping, value) and model version, 0 entries disables the cache.
+prediction_cache_size = 10000
+prediction_cache_ttl = 300  # seconds
+# Seconds between listings of the endpoint's deployed models, cached predictions of other models are not used.
+deployed_models_poll_interval = 30
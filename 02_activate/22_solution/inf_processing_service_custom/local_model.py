@@ -0,0 +1,154 @@
+# Copyright 2023 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import base64
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+from joblib import load
+
+from google.api_core.exceptions import NotFound
+from google.cloud import storage
+
+# Column order the model was trained with, see custom_train/trainer/preprocess.py.
+FEATURES = ("tax", "shipping", "value")
+
+
+class LocalModel:
+    """The trained model.joblib, loaded into the service to score purchases in-process.
+
+    `uri` is a local path or a gs:// URI. The artifact is checked for a new
+    version (GCS generation or file mtime) every `poll_interval` seconds and
+    swapped in without blocking requests that are being scored. Downloads are
+    checked against the MD5 hash GCS reports. Until a first version is loaded
+    it is retried every RETRY_INTERVAL seconds.
+
+    The polling, verification and retries follow ModelStore in
+    custom_train/prediction/model_store.py, change both together.
+    """
+
+    # Seconds between attempts while no version could be loaded yet, as ModelStore.RETRY_INTERVAL.
+    RETRY_INTERVAL = 5
+
+    def __init__(self, uri, poll_interval=60, storage_client=None):
+        self.uri = uri
+        self.poll_interval = poll_interval
+        self.storage_client = storage_client
+
+        # (model, version) is replaced as a whole so readers always see a matching pair.
+        self._current = (None, None)
+        self._reload_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def available(self):
+        return self._current[0] is not None
+
+    @property
+    def version(self):
+        return self._current[1]
+
+    def start(self):
+        """Load the model now and keep watching for new versions in the background."""
+        self.reload()
+        if self._thread is None and (self.poll_interval or not self.available):
+            self._thread = threading.Thread(target=self._watch, name="model-watcher", daemon=True)
+            self._thread.start()
+
+    def predict(self, instances):
+        return self.predict_versioned(instances)[1]
+
+    def predict_versioned(self, instances):
+        """(version, predictions), both of the same model even while a new one is swapped in."""
+        model, version = self._current
+        if model is None:
+            raise RuntimeError(f"No model loaded from {self.uri}")
+
+        data = np.array([[instance[feature] for feature in FEATURES] for instance in instances], dtype=np.float64)
+        return version, model.predict(data).tolist()
+
+    def reload(self):
+        """Load the artifact if its version differs from the one in use. Returns True if it was swapped."""
+        with self._reload_lock:
+            try:
+                version, md5_hash = self._artifact_version()
+                if version is None:
+                    print(f"{time.time()} No model found at {self.uri}.")
+                    return False
+                if version == self.version:
+                    return False
+
+                start = time.time()
+                model = self._load(version, md5_hash)
+            except Exception as e:
+                # Keep serving the model we have, the next poll tries again.
+                print(f"{time.time()} Loading model from {self.uri} failed: {e}")
+                return False
+
+            self._current = (model, version)
+            print(f"{time.time()} Loaded model version {version} in {time.time() - start:.3f}s.")
+            return True
+
+    def _watch(self):
+        while True:
+            if self.available:
+                if not self.poll_interval:
+                    return
+                time.sleep(self.poll_interval)
+            else:
+                time.sleep(self.RETRY_INTERVAL)
+            self.reload()
+
+    def _blob(self):
+        if self.storage_client is None:
+            self.storage_client = storage.Client()
+        return storage.blob.Blob.from_string(self.uri, client=self.storage_client)
+
+    def _artifact_version(self):
+        """(version, MD5 digest) of the artifact, (None, None) if there is none. Local files have no digest."""
+        if self.uri.startswith("gs://"):
+            blob = self._blob()
+            try:
+                blob.reload()
+            except NotFound:
+                return None, None
+            return blob.generation, base64.b64decode(blob.md5_hash)
+
+        if not os.path.exists(self.uri):
+            return None, None
+        stat = os.stat(self.uri)
+        return f"{stat.st_mtime_ns}-{stat.st_size}", None
+
+    def _load(self, version, md5_hash):
+        if not self.uri.startswith("gs://"):
+            with open(self.uri, 'rb') as f:
+                return load(f)
+
+        with tempfile.TemporaryFile() as f:
+            # Reads the generation checked above, even if the trainer has uploaded a newer one meanwhile.
+            blob = self._blob()
+            blob = storage.Blob(blob.name, blob.bucket, generation=version)
+            blob.download_to_file(f)
+            f.seek(0)
+            digest = hashlib.md5()
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+            if digest.digest() != md5_hash:
+                raise ValueError(f"MD5 of {self.uri} generation {version} does not match")
+            f.seek(0)
+            return load(f)
@@ -21,11 +21,55 @@ import config
 
 from flask import Flask, request
 
-from google.cloud import bigquery, aiplatform
+import clients
+from local_model import LocalModel
+from prediction_cache import PredictionCache
 
 
 app = Flask(__name__)
 
+# Clients are created once per worker and shared by all request threads.
+pool = clients.create_pool()
+pool.warm_up()
+
+table_id = config.project_id + '.' + config.bq_dataset + '.' + config.bq_table
+table_id_anomaly = config.project_id + '.' + config.bq_dataset + '.' + config.bq_table_anomaly
+
+# In embedded mode purchases are scored in-process, the endpoint is only used while no model could be loaded.
+local_model = None
+if config.scoring_mode == "embedded":
+    local_model = LocalModel(config.model_uri, poll_interval=config.model_poll_interval)
+    local_model.start()
+
+
+# Purchases repeat the same features often, their predictions are reused until the model changes.
+cache = PredictionCache(max_entries=config.prediction_cache_size, ttl=config.prediction_cache_ttl)
+deployed_models = clients.DeployedModels(pool, config.deployed_models_poll_interval)
+
+
+def predict(instances):
+    """(model version, predictions), the version keys the cached predictions."""
+    if local_model is not None and local_model.available:
+        return local_model.predict_versioned(instances)
+
+    with pool.use("endpoint") as endpoint:
+        response = endpoint.predict(instances=instances)
+        return response.deployed_model_id, response.predictions
+
+
+def score(features):
+    # Only predictions of the model that would answer now are reused, the endpoint is asked which ones are deployed.
+    if local_model is not None and local_model.available:
+        versions = (local_model.version,)
+    else:
+        versions = deployed_models.get()
+    prediction = cache.get(features, versions)
+    if prediction is None:
+        version, predictions = predict([features])
+        prediction = predictions[0]
+        cache.put(version, features, prediction)
+    return prediction
+
 
 @app.route("/hw", methods=['GET', 'POST'])
 def hello_world():
@@ -33,6 +77,11 @@ def hello_world():
     return f"Hello {world}!"
 
 
+@app.route("/cache_stats", methods=["GET"])
+def cache_stats():
+    return cache.stats()
+
+
 @app.route("/", methods=["POST"])
 def index():
     envelope = request.get_json()
@@ -53,10 +102,8 @@ def index():
 
     rows_to_insert = [record]
 
-    client = bigquery.Client(project=config.project_id, location=config.location)
-    table_id = config.project_id + '.' + config.bq_dataset + '.' + config.bq_table
-
-    errors = client.insert_rows_json(table_id, rows_to_insert)  # Make an API request.
+    with pool.use("bigquery") as client:
+        errors = client.insert_rows_json(table_id, rows_to_insert)  # Make an API request.
 
 
     # Create record that includes anomaly detection inference.
@@ -67,35 +114,21 @@ def index():
             "value":record["ecommerce"]["purchase"]["value"]}
             ]
 
-        aiplatform.init(project=config.project_id, location=config.location)
-
-        endpoint = aiplatform.Endpoint(
-            endpoint_name=f"projects/{config.project_id}/locations/{config.location}/endpoints/{config.endpoind_id}",
-            project = config.project_id,
-            location=config.location,
-            )
-
-        endpoint_response = endpoint.predict(
-            instances=record_to_predict
-        )
-
-        anomaly = endpoint_response.predictions[0]
+        anomaly = score(record_to_predict[0])
 
         anomaly_record = {"tax": record["ecommerce"]["purchase"]["tax"], "shipping": record["ecommerce"]["purchase"]["shipping"], "value":record["ecommerce"]["purchase"]["value"], "anomaly": anomaly}
 
         rows_to_insert = [anomaly_record]
 
-        client = bigquery.Client(project=config.project_id, location=config.location)
-        table_id = config.project_id + '.' + config.bq_dataset + '.' + config.bq_table_anomaly
-
-        errors_an = client.insert_rows_json(table_id, rows_to_insert)  # Make an API request.
+        with pool.use("bigquery") as client:
+            errors_an = client.insert_rows_json(table_id_anomaly, rows_to_insert)  # Make an API request.
 
 
         if errors_an == []:
             print(f"{time.time()} New rows with prediction have been added.")
             return ("", 204)
         else:
-            print("Encountered errors while inserting rows: {}".format(errors))
+            print("Encountered errors while inserting rows: {}".format(errors_an))
             return f"Bad Request: {envelope}", 400
 
     if errors == []:
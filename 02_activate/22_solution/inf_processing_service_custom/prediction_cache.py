@@ -0,0 +1,104 @@
+# Copyright 2023 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+
+from collections import Counter, OrderedDict
+
+FEATURES = ("tax", "shipping", "value")
+
+
+def feature_key(features):
+    """The features as a tuple of floats, so 35, 35.0 and -0.0 / 0.0 share an entry. None for NaN."""
+    key = tuple(float(features[feature]) + 0.0 for feature in FEATURES)
+    if any(value != value for value in key):
+        return None
+    return key
+
+
+class PredictionCache:
+    """Bounded LRU cache of predictions keyed on the model version and the purchase features.
+
+    Predictions of different versions are kept side by side. A lookup names the
+    `versions` that could answer the purchase now, the local model's version or
+    the ids of the models deployed to the endpoint (several under a traffic
+    split), and only their entries are returned. Entries of versions that are no
+    longer asked for are evicted like any other, and none is returned after
+    `ttl` seconds. At most `max_entries` predictions are kept, the least
+    recently used one is evicted first. `max_entries` 0 disables the cache.
+    """
+
+    def __init__(self, max_entries=10000, ttl=300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        self._lock = threading.Lock()
+        # (version, feature key) -> (prediction, expiry time)
+        self._entries = OrderedDict()
+
+    def get(self, features, versions):
+        """The cached prediction of one of `versions` for `features`, None if there is none.
+
+        Without known versions, e.g. before the deployed models were listed, nothing is returned.
+        """
+        key = feature_key(features)
+        with self._lock:
+            for version in versions or ():
+                entry = self._entries.get((version, key)) if key is not None else None
+                if entry is None:
+                    continue
+                prediction, expires = entry
+                if expires <= time.monotonic():
+                    del self._entries[(version, key)]
+                    self.expirations += 1
+                    continue
+                self._entries.move_to_end((version, key))
+                self.hits += 1
+                return prediction
+            self.misses += 1
+            return None
+
+    def put(self, version, features, prediction):
+        """Caches the prediction `version` of the model made for `features`."""
+        key = feature_key(features)
+        if not self.max_entries or key is None:
+            return
+        with self._lock:
+            self._entries[(version, key)] = (prediction, time.monotonic() + self.ttl)
+            self._entries.move_to_end((version, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            versions = Counter(version for version, _ in self._entries)
+            return {
+                "versions": {str(version): count for version, count in versions.items()},
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else None,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
@@ -0,0 +1,150 @@
+# Copyright 2023 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# In-process stand-ins for the BigQuery and Vertex AI clients used by the processing services.
+
+import json
+import sqlite3
+import sys
+import threading
+import time
+import types
+
+
+class StageStats:
+    """Call counts and latencies per pipeline stage, e.g. 'bigquery:<table>' or 'predict'."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.items = {}
+        self.latencies = {}
+
+    def record(self, stage, items, latency):
+        with self.lock:
+            self.calls[stage] = self.calls.get(stage, 0) + 1
+            self.items[stage] = self.items.get(stage, 0) + items
+            self.latencies.setdefault(stage, []).append(latency)
+
+    def report(self):
+        report = {}
+        for stage, latencies in sorted(self.latencies.items()):
+            latencies = sorted(latencies)
+            report[stage] = {
+                "calls": self.calls[stage],
+                "items": self.items[stage],
+                "items_per_call": self.items[stage] / self.calls[stage],
+                "mean_ms": 1000 * sum(latencies) / len(latencies),
+                "p95_ms": 1000 * latencies[int(0.95 * (len(latencies) - 1))],
+            }
+        return report
+
+
+class SQLiteSink:
+    """Stores streamed rows as JSON in SQLite, one row per inserted record."""
+
+    def __init__(self, path=":memory:"):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS rows (table_id TEXT, inserted_at REAL, data TEXT)")
+
+    def insert(self, table_id, rows):
+        now = time.time()
+        with self.lock:
+            self.connection.executemany(
+                "INSERT INTO rows VALUES (?, ?, ?)",
+                [(table_id, now, json.dumps(row)) for row in rows])
+            self.connection.commit()
+
+    def count(self, table_id=None):
+        with self.lock:
+            if table_id is None:
+                return dict(self.connection.execute("SELECT table_id, COUNT(*) FROM rows GROUP BY table_id"))
+            return self.connection.execute("SELECT COUNT(*) FROM rows WHERE table_id = ?", (table_id,)).fetchone()[0]
+
+
+class FakeBigQueryClient:
+    """Implements `insert_rows_json` of `bigquery.Client` on top of a SQLiteSink."""
+
+    def __init__(self, sink, stats, latency=0.0):
+        self.sink = sink
+        self.stats = stats
+        self.latency = latency
+
+    def insert_rows_json(self, table_id, rows, **kwargs):
+        start = time.perf_counter()
+        if self.latency:
+            time.sleep(self.latency)
+        self.sink.insert(table_id, rows)
+        self.stats.record(f"bigquery:{table_id}", len(rows), time.perf_counter() - start)
+        return []
+
+
+class FakePrediction:
+    def __init__(self, predictions, deployed_model_id="fake-kmeans"):
+        self.predictions = predictions
+        self.deployed_model_id = deployed_model_id
+
+
+class FakeKMeansEndpoint:
+    """Answers like the deployed BQML KMEANS model, purchases above `threshold` land in centroid 1."""
+
+    def __init__(self, stats, latency=0.0, threshold=10000.0):
+        self.stats = stats
+        self.latency = latency
+        self.threshold = threshold
+
+    def predict(self, instances):
+        start = time.perf_counter()
+        if self.latency:
+            time.sleep(self.latency)
+        predictions = [{"nearest_centroid_id": [1 if instance["value"] > self.threshold else 2]}
+                       for instance in instances]
+        self.stats.record("predict", len(instances), time.perf_counter() - start)
+        return FakePrediction(predictions)
+
+    def list_models(self):
+        return [types.SimpleNamespace(id="fake-kmeans")]
+
+
+def _module(name):
+    module = sys.modules.get(name)
+    if module is None:
+        module = types.ModuleType(name)
+        module.__path__ = []
+        sys.modules[name] = module
+    return module
+
+
+def install(sink, stats, bq_latency=0.0, predict_latency=0.0):
+    """Registers fake `google.cloud.bigquery` and `google.cloud.aiplatform` modules.
+
+    Must run before the services are imported, their `from google.cloud import ...`
+    then resolves to these fakes instead of the real client libraries.
+    """
+    google = _module("google")
+    cloud = _module("google.cloud")
+    google.cloud = cloud
+
+    bigquery = types.ModuleType("google.cloud.bigquery")
+    bigquery.Client = lambda *args, **kwargs: FakeBigQueryClient(sink, stats, bq_latency)
+
+    aiplatform = types.ModuleType("google.cloud.aiplatform")
+    aiplatform.init = lambda *args, **kwargs: None
+    aiplatform.Endpoint = lambda *args, **kwargs: FakeKMeansEndpoint(stats, predict_latency)
+
+    for name, module in (("bigquery", bigquery), ("aiplatform", aiplatform)):
+        sys.modules[f"google.cloud.{name}"] = module
+        setattr(cloud, name, module)
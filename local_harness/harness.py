@@ -0,0 +1,188 @@
+# Copyright 2023 Google
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Runs the processing services end to end on one machine:
+# synthetic events -> in-process Pub/Sub push emulator -> unmodified service apps -> SQLite backed fake BigQuery.
+#
+# python3 harness.py --services processing-service inf_processing_service --events 20000 --concurrency 64
+
+import argparse
+import base64
+import contextlib
+import datetime
+import importlib
+import json
+import os
+import sys
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+import fake_gcp
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVICES = {
+    "processing-service": os.path.join(REPO_ROOT, "01_ingest_and_transform", "12_solution", "processing-service"),
+    "inf_processing_service": os.path.join(REPO_ROOT, "02_activate", "22_solution", "inf_processing_service"),
+}
+DATALAYER_DIR = os.path.join(REPO_ROOT, "01_ingest_and_transform", "12_solution", "datalayer")
+
+
+def load_module(directory, name):
+    """Imports `name` from `directory` without leaking its flat module names.
+
+    Every service has its own main.py, config.py, ... so they are removed from
+    sys.modules again once imported. The loaded module keeps its references.
+    """
+    local = {os.path.splitext(f)[0] for f in os.listdir(directory) if f.endswith(".py")}
+    for module in local:
+        sys.modules.pop(module, None)
+
+    sys.path.insert(0, directory)
+    try:
+        return importlib.import_module(name)
+    finally:
+        sys.path.remove(directory)
+        for module in local:
+            sys.modules.pop(module, None)
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    if not latencies:
+        return {}
+    return {f"p{q}_ms": 1000 * latencies[int(q / 100 * (len(latencies) - 1))] for q in (50, 95, 99)}
+
+
+class PushSubscription:
+    """Delivers messages to a Flask app like a Pub/Sub push subscription, redelivering on non-2xx answers."""
+
+    def __init__(self, name, app, max_attempts=5, backoff=0.01):
+        self.name = name
+        self.app = app
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+
+        self.lock = threading.Lock()
+        self.acked = 0
+        self.dead_lettered = 0
+        self.redeliveries = 0
+        self.latencies = []
+        self._local = threading.local()
+
+    def _client(self):
+        # Flask test clients are not shared between threads.
+        if not hasattr(self._local, "client"):
+            self._local.client = self.app.test_client()
+        return self._local.client
+
+    def deliver(self, message, published):
+        envelope = {"message": message, "subscription": f"projects/local/subscriptions/{self.name}"}
+
+        for attempt in range(self.max_attempts):
+            response = self._client().post("/", json=envelope)
+            if 200 <= response.status_code < 300:
+                with self.lock:
+                    self.acked += 1
+                    self.redeliveries += attempt
+                    self.latencies.append(time.perf_counter() - published)
+                return
+            time.sleep(self.backoff * 2 ** attempt)
+
+        with self.lock:
+            self.dead_lettered += 1
+            self.redeliveries += self.max_attempts - 1
+
+    def report(self):
+        return dict({"acked": self.acked, "dead_lettered": self.dead_lettered, "redeliveries": self.redeliveries},
+                    **percentiles(self.latencies))
+
+
+def run(args):
+    stats = fake_gcp.StageStats()
+    sink = fake_gcp.SQLiteSink(args.sink)
+    fake_gcp.install(sink, stats, bq_latency=args.bq_latency, predict_latency=args.predict_latency)
+
+    synth = load_module(DATALAYER_DIR, "synth_data_stream")
+    if args.corpus:
+        events = synth.read_corpus(args.corpus)
+        if args.events is not None:
+            events = (event for _, event in zip(range(args.events), events))
+    else:
+        events = synth.generate_corpus(args.events or 10000, synth.load_fixtures(), synth.DEFAULT_MIX,
+                                       args.users, seed=args.seed)
+
+    subscriptions = []
+    for name in args.services:
+        start = time.perf_counter()
+        service = load_module(SERVICES[name], "main")
+        print(f"Loaded {name} in {time.perf_counter() - start:.2f}s")
+        subscriptions.append(PushSubscription(name, service.app, max_attempts=args.max_attempts))
+
+    published = 0
+    in_flight = threading.BoundedSemaphore(args.concurrency * 2)
+    # The services log every request, that would dominate the measurement.
+    logs = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+    start = time.perf_counter()
+    with logs, ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for event in events:
+            message = {
+                "data": base64.b64encode(json.dumps(event).encode("utf-8")).decode("ascii"),
+                "messageId": str(published),
+                "publishTime": datetime.datetime.utcnow().isoformat() + "Z",
+            }
+            now = time.perf_counter()
+            for subscription in subscriptions:
+                in_flight.acquire()
+                future = executor.submit(subscription.deliver, message, now)
+                future.add_done_callback(lambda _: in_flight.release())
+            published += 1
+    elapsed = time.perf_counter() - start
+
+    report = {
+        "events": published,
+        "elapsed_s": elapsed,
+        "events_per_s": published / elapsed,
+        "subscriptions": {subscription.name: subscription.report() for subscription in subscriptions},
+        "stages": stats.report(),
+        "sink_rows": sink.count(),
+    }
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--services", nargs="+", choices=sorted(SERVICES), default=["processing-service"],
+                        help="Services subscribed to the topic, every event is pushed to each of them")
+    parser.add_argument("--events", type=int, help="Number of events to publish, 10000 generated or the whole corpus by default")
+    parser.add_argument("--corpus", help="Replay events from a synth_data_stream.py corpus file instead of generating them")
+    parser.add_argument("--users", type=int, default=1000, help="Distinct user_ids of generated events")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of generated events")
+    parser.add_argument("--concurrency", type=int, default=32, help="Pushes in flight at the same time")
+    parser.add_argument("--max-attempts", type=int, default=5, help="Deliveries of a message before it is dead-lettered")
+    parser.add_argument("--bq-latency", type=float, default=0.0, help="Simulated seconds per BigQuery insert call")
+    parser.add_argument("--predict-latency", type=float, default=0.0, help="Simulated seconds per predict call")
+    parser.add_argument("--sink", default=":memory:", help="SQLite file receiving the rows")
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    parser.add_argument("--verbose", action="store_true", help="Show the log output of the services")
+
+    args = parser.parse_args()
+    report = run(args)
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)